@@ -0,0 +1,145 @@
+"""
+Helpers of the benchmark scripts, to run on CPython from this directory :
+    python bench/<script>.py
+The server is started on 127.0.0.1 and serves the files of ../www.
+"""
+
+import os, sys, time, socket, struct, http.client
+from   base64 import b64encode
+
+HOST_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, HOST_DIR)
+
+from microWebSrv import MicroWebSrv
+
+def startServer(routes=None, port=18080, webPath=None, **attrs) :
+    mws = MicroWebSrv( routeHandlers = list(routes or []),
+                       port          = port,
+                       bindIP        = '127.0.0.1',
+                       webPath       = webPath or os.path.join(HOST_DIR, 'www') )
+    for name, value in attrs.items() :
+        setattr(mws, name, value)
+    mws.Start(threaded=True)
+    time.sleep(0.2)
+    return mws
+
+def httpGet(path, headers=None, port=18080, method='GET', body=None) :
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+    conn.request(method, path, body=body, headers=headers or { })
+    resp = conn.getresponse()
+    data = resp.read()
+    conn.close()
+    return resp.status, dict((k.lower(), v) for k, v in resp.getheaders()), data
+
+def timeIt(func, count) :
+    # Returns the mean time of func in seconds, after a first warm up call
+    func()
+    t = time.perf_counter()
+    for x in range(count) :
+        func()
+    return (time.perf_counter() - t) / count
+
+class MPSocket :
+    # MicroPython-like socket given to MicroWebSrv over a CPython one : no
+    # socket file, each write is one send without Nagle (as lwIP) and the
+    # writes of each closed connection are recorded.
+
+    IsStreamSocket = True
+    writes         = [ ]
+    servers        = [ ]
+
+    def __init__(self, sock) :
+        self._sock   = sock
+        self._writes = 0
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def write(self, data) :
+        self._writes += 1
+        return self._sock.send(data)
+
+    def recv(self, n) :
+        return self._sock.recv(n)
+
+    def read(self, n) :
+        return self._sock.recv(n)
+
+    def settimeout(self, timeout) :
+        self._sock.settimeout(timeout)
+
+    def getsockopt(self, *args) :
+        return self._sock.getsockopt(*args)
+
+    def close(self) :
+        MPSocket.writes.append(self._writes)
+        self._sock.close()
+
+def useMPSockets(mws) :
+    # Connections accepted by mws are given to it as MPSocket
+    if not MPSocket.servers :
+        init = MicroWebSrv._client.__init__
+        def _init(self, microWebSrv, sock, addr) :
+            if microWebSrv in MPSocket.servers :
+                sock = MPSocket(sock)
+            init(self, microWebSrv, sock, addr)
+        MicroWebSrv._client.__init__ = _init
+    MPSocket.servers.append(mws)
+
+class WSClient :
+
+    def __init__(self, port=18080, path='/', headers='') :
+        self.sock = socket.create_connection(('127.0.0.1', port))
+        self.sock.settimeout(5)
+        key = b64encode(os.urandom(16)).decode()
+        self.sock.sendall(( 'GET %s HTTP/1.1\r\nHost: bench\r\n'
+                            'Upgrade: websocket\r\nConnection: Upgrade\r\n'
+                            'Sec-WebSocket-Key: %s\r\nSec-WebSocket-Version: 13\r\n'
+                            '%s\r\n' % (path, key, headers) ).encode())
+        self.buf = b''
+        while b'\r\n\r\n' not in self.buf :
+            data = self.sock.recv(4096)
+            if not data :
+                raise Exception('Connection closed during the handshake')
+            self.buf += data
+        x = self.buf.index(b'\r\n\r\n') + 4
+        self.response, self.buf = self.buf[:x].decode(), self.buf[x:]
+
+    @staticmethod
+    def encodeFrame(opcode, data, fin=True, rsv=0) :
+        n  = len(data)
+        b1 = (0x80 if fin else 0) | rsv | opcode
+        if n < 126 :
+            hdr = struct.pack('>BB', b1, 0x80 | n)
+        elif n < 65536 :
+            hdr = struct.pack('>BBH', b1, 0x80 | 126, n)
+        else :
+            hdr = struct.pack('>BBQ', b1, 0x80 | 127, n)
+        mask = os.urandom(4)
+        if n :
+            x    = int.from_bytes(data, 'big') ^ int.from_bytes((mask * (n // 4 + 1))[:n], 'big')
+            data = x.to_bytes(n, 'big')
+        return hdr + mask + data
+
+    def send(self, opcode, data, fin=True, rsv=0) :
+        self.sock.sendall(self.encodeFrame(opcode, data, fin, rsv))
+
+    def _read(self, n) :
+        while len(self.buf) < n :
+            data = self.sock.recv(65536)
+            if not data :
+                raise Exception('Connection closed')
+            self.buf += data
+        data, self.buf = self.buf[:n], self.buf[n:]
+        return data
+
+    def recv(self) :
+        # Returns (first header byte, payload) of the next frame
+        b1, b2 = self._read(2)
+        n = b2 & 0x7F
+        if n == 126 :
+            n = struct.unpack('>H', self._read(2))[0]
+        elif n == 127 :
+            n = struct.unpack('>Q', self._read(8))[0]
+        return b1, self._read(n)
+
+    def close(self) :
+        self.sock.close()
@@ -0,0 +1,29 @@
+"""
+Throughput of WriteResponseFile on loopback, for a 600 KB file not kept
+in the static files RAM cache :
+- CPython socket file, the kernel sending the file (sendfile),
+- MicroPython-like sockets, the file sent through the reused buffer
+  sized from SO_SNDBUF and FileBufferMaxSize.
+"""
+
+import os, tempfile
+from   benchutil import startServer, httpGet, timeIt, useMPSockets
+
+SIZE  = 600 * 1024
+COUNT = 50
+
+webPath = tempfile.mkdtemp()
+data    = os.urandom(SIZE)
+with open(os.path.join(webPath, 'big.zip'), 'wb') as file :
+    file.write(data)
+
+for port, mpSockets in ((18093, False), (18094, True)) :
+    mws = startServer(port=port, webPath=webPath, StaticFileCacheSize=0)
+    if mpSockets :
+        useMPSockets(mws)
+    assert httpGet('/big.zip', port=port)[2] == data
+    t = timeIt(lambda : httpGet('/big.zip', port=port), COUNT)
+    print( '%-34s : %5.0f MB/s%s'
+           % ( 'MicroPython-like socket writes' if mpSockets else 'CPython socket file (sendfile)',
+               SIZE / t / 1e6,
+               (', %d bytes buffer' % len(mws._fileBuf)) if mws._fileBuf is not None else '' ) )
@@ -0,0 +1,90 @@
+"""
+Parsing of a browser request (request line and 10 headers) in the shared
+receive buffer, as MicroWebSrv._client does it :
+- blocks allocated by microWebSrv.py and still alive per request (query
+  parameters and the headers kept by ParsedRequestHeaders),
+- with bytearray.find (CPython) and without it, as on MicroPython,
+- request line longer than RequestBufferSize answered by 414.
+"""
+
+import socket, time, tracemalloc
+from   benchutil   import startServer
+from   microWebSrv import MicroWebSrv
+
+REQUEST = ( b'GET /static/male.png?x=1 HTTP/1.1\r\nHost: 192.168.1.50\r\nConnection: keep-alive\r\n'
+            b'User-Agent: Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 Chrome/120.0 Safari/537.36\r\n'
+            b'Accept: image/avif,image/webp,image/apng,image/*,*/*;q=0.8\r\nReferer: http://192.168.1.50/\r\n'
+            b'Accept-Encoding: gzip, deflate\r\nAccept-Language: en-US,en;q=0.9,vi;q=0.8\r\n'
+            b'If-None-Match: "6ad61977-3d26"\r\nCache-Control: max-age=0\r\n\r\n' )
+COUNT = 300
+
+def _newClient(mws, sock) :
+    # Client state set by MicroWebSrv._client.__init__, without processing
+    cli = object.__new__(MicroWebSrv._client)
+    cli._microWebSrv   = mws
+    cli._socket        = sock
+    cli._socketfile    = sock.makefile('rwb')
+    cli._method        = None
+    cli._path          = None
+    cli._httpVer       = None
+    cli._resPath       = '/'
+    cli._queryString   = ''
+    cli._queryParams   = { }
+    cli._headers       = { }
+    cli._contentType   = None
+    cli._contentLength = 0
+    cli._recvBuf       = mws._getRecvBuf()
+    cli._recvMv        = memoryview(cli._recvBuf)
+    cli._recvPos       = 0
+    cli._recvEnd       = 0
+    cli._recvFind      = None
+    cli._contentUnread = 0
+    return cli
+
+def _parse(bufHasFind) :
+    MicroWebSrv._bufHasFind = bufHasFind
+    mws     = MicroWebSrv(port=0)
+    clients = [ ]
+    for x in range(COUNT) :
+        a, b = socket.socketpair()
+        b.sendall(REQUEST)
+        clients.append((_newClient(mws, a), a, b))
+    tracemalloc.start()
+    snap0 = tracemalloc.take_snapshot()
+    t     = time.perf_counter()
+    for cli, a, b in clients :
+        assert cli._parseFirstLine(None) and cli._parseHeader(None)
+    t     = time.perf_counter() - t
+    snap1 = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    srcFile = MicroWebSrv.__init__.__code__.co_filename
+    blocks  = sum( s.count_diff for s in snap1.compare_to(snap0, 'filename')
+                   if s.traceback[0].filename == srcFile )
+    print( '%-24s : %5.1f us/request, %4.1f blocks alive/request, headers %s'
+           % ( 'bytearray.find' if bufHasFind else 'no find (MicroPython)',
+               t / COUNT * 1e6, blocks / COUNT, sorted(clients[0][0]._headers) ) )
+    for cli, a, b in clients :
+        cli._socketfile.close()
+        a.close()
+        b.close()
+
+bufHasFind = MicroWebSrv._bufHasFind
+_parse(True)
+_parse(False)
+MicroWebSrv._bufHasFind = bufHasFind
+
+mws  = startServer(port=18090)
+sock = socket.create_connection(('127.0.0.1', 18090))
+sock.sendall(b'GET /' + b'a' * (2 * mws.RequestBufferSize) + b' HTTP/1.1\r\nHost: bench\r\n\r\n')
+resp = b''
+try :
+    while True :
+        data = sock.recv(4096)
+        if not data :
+            break
+        resp += data
+except OSError :
+    pass
+sock.close()
+print( 'request line of %d bytes : %s'
+       % (2 * mws.RequestBufferSize, resp.split(b'\r\n')[0].decode() or 'no response') )
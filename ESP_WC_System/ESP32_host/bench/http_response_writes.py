@@ -0,0 +1,24 @@
+"""
+Socket writes and latency of small responses on loopback, with
+MicroPython-like sockets (each write is one send, so one TCP segment at
+least, as with lwIP) :
+- JSON answer of a route, 457 bytes CSS, 4.5 KB PNG and 404 page,
+- static files RAM cache off then on.
+"""
+
+from benchutil import startServer, httpGet, timeIt, useMPSockets, MPSocket
+
+def _jsonStatus(httpClient, httpResponse) :
+    httpResponse.WriteResponseJSONOk({ 'wc1' : [0, 1, 0], 'wc2' : [1, 1, 0] })
+
+for port, cacheSize in ((18091, 0), (18092, 48 * 1024)) :
+    mws = startServer( [ ('/json', 'GET', _jsonStatus) ],
+                       port                = port,
+                       StaticFileCacheSize = cacheSize )
+    useMPSockets(mws)
+    print('Static files RAM cache %s :' % ('on' if cacheSize else 'off'))
+    for path in ('/json', '/style.css', '/pdf.png', '/nothing.html') :
+        del MPSocket.writes[:]
+        t = timeIt(lambda : httpGet(path, port=port), 200)
+        print( '  GET %-13s : %4.1f writes/response, %4.0f us'
+               % (path, sum(MPSocket.writes) / len(MPSocket.writes), t * 1e6) )
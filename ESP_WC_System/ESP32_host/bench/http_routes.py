@@ -0,0 +1,68 @@
+"""
+Route lookup by MicroWebSrv.GetRouteHandler with 69 routes (literal ones
+for 15 nodes, one shadowed by an earlier '/<x>', and routes with
+arguments), against the linear scan of the route regexes it replaced :
+- same handler and arguments for 15000 random URLs and methods,
+- lookup time of literal, argument and unknown URLs.
+"""
+
+import random
+from   benchutil   import timeIt
+from   microWebSrv import MicroWebSrv
+
+def _linearLookup(mws, resUrl, method) :
+    if resUrl.endswith('/') :
+        resUrl = resUrl[:-1]
+    method = method.upper()
+    for rh in mws._routeHandlers :
+        if rh.method == method :
+            m = rh.routeRegex.match(resUrl)
+            if m :
+                if rh.routeArgNames :
+                    routeArgs = { }
+                    for i, name in enumerate(rh.routeArgNames) :
+                        value = m.group(i+1)
+                        try :
+                            value = int(value)
+                        except :
+                            pass
+                        routeArgs[name] = value
+                    return (rh.func, routeArgs)
+                return (rh.func, None)
+    return (None, None)
+
+def _handler(idx) :
+    return lambda httpClient, httpResponse, routeArgs=None : idx
+
+routes = [ ('/', 'GET'), ('/control', 'POST'), ('/<x>', 'GET'), ('/status', 'GET') ]
+for node in range(1, 16) :
+    for ch in range(1, 4) :
+        routes.append(('/api/node/wc%d/channel/%d' % (node, ch), 'POST'))
+    routes.append(('/api/node/wc%d/status' % node, 'GET'))
+routes += [ ('/api/node/<node>/channel/<ch>', 'POST'),
+            ('/api/node/<node>/status',       'GET'),
+            ('/api/node/<node>',              'GET'),
+            ('/api/<a>/<b>/status',           'GET'),
+            ('/static/<f>',                   'GET') ]
+mws = MicroWebSrv( routeHandlers = [ (route, method, _handler(i))
+                                     for i, (route, method) in enumerate(routes) ] )
+
+random.seed(1)
+segs = [ 'api', 'node', 'wc1', 'wc7', 'wc99', 'channel', '1', '3',
+         'status', 'control', '', 'x-y', 'static', 'a.png' ]
+urls = [ '/', '/control', '/control/' ]
+for x in range(5000) :
+    urls.append('/' + '/'.join(random.choice(segs) for y in range(random.randint(0, 6))))
+for url in urls :
+    for method in ('GET', 'POST', 'get') :
+        assert mws.GetRouteHandler(url, method) == _linearLookup(mws, url, method), (url, method)
+print('%d routes, %d lookups : same handlers as the linear scan' % (len(routes), len(urls) * 3))
+
+for url, method in ( ('/control',                 'POST'),
+                     ('/api/node/wc10/channel/3', 'POST'),
+                     ('/api/node/wc42/channel/2', 'POST'),
+                     ('/api/node/wc3/status',     'GET' ),
+                     ('/nothing/here/at/all',     'GET' ) ) :
+    t1 = timeIt(lambda : _linearLookup(mws, url, method), 20000)
+    t2 = timeIt(lambda : mws.GetRouteHandler(url, method), 20000)
+    print('%-4s %-26s : linear %5.2f us, indexed %5.2f us' % (method, url, t1 * 1e6, t2 * 1e6))
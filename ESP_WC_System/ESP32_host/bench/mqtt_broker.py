@@ -0,0 +1,298 @@
+"""
+Local MQTT 3.1.1 broker stand-in and CPython socket adapter, used by the
+mqtt_*.py benchmark scripts to run lib/wcmqtt clients on CPython :
+- CONNECT with persistent sessions, SUBSCRIBE on exact topics, QoS 0/1,
+  PINGREQ, DISCONNECT,
+- killAll() drops the connections, refuse/answerPings/answerSubs/
+  ackPublishes/ackDelay simulate a broker down, a dead link, lost or late
+  acknowledgements.
+"""
+
+import os, sys, socket, struct, threading, time, types
+
+HOST_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(HOST_DIR, 'lib'))
+
+# ============================================================================
+# ===( CPython socket adapter )===============================================
+# ============================================================================
+
+class ShimSocket :
+    # MicroPython socket methods used by wcmqtt (read, write, readinto) over
+    # a CPython socket. Each write is sent at once (TCP_NODELAY), as lwIP
+    # does, and counted.
+
+    writes = 0
+
+    def __init__(self, *args) :
+        self._sock = socket.socket(*args)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def connect(self, addr) :
+        self._sock.connect(addr)
+
+    def settimeout(self, timeout) :
+        self._sock.settimeout(timeout)
+
+    def setblocking(self, flag) :
+        self._sock.setblocking(flag)
+
+    def fileno(self) :
+        return self._sock.fileno()
+
+    def close(self) :
+        self._sock.close()
+
+    def write(self, data, length=None) :
+        if length is not None :
+            data = memoryview(data)[:length]
+        if isinstance(data, str) :
+            data = data.encode()
+        self._sock.sendall(data)
+        ShimSocket.writes += 1
+        return len(data)
+
+    def read(self, n) :
+        data = b''
+        try :
+            while len(data) < n :
+                x = self._sock.recv(n - len(data))
+                if not x :
+                    break
+                data += x
+        except BlockingIOError :
+            if not data :
+                return None
+        return data
+
+    def readinto(self, buf) :
+        # As on MicroPython : a blocking socket waits until buf is full (or
+        # raises on timeout, the bytes read being lost), a non-blocking one
+        # takes the bytes already received, None if there are none.
+        mv = memoryview(buf)
+        n  = 0
+        try :
+            while n < len(mv) :
+                x = self._sock.recv_into(mv[n:])
+                if not x :
+                    break
+                n += x
+        except BlockingIOError :
+            if not n :
+                return None
+        return n
+
+def installSocketShim() :
+    # wcmqtt.simple creates its sockets with this module instead of socket
+    from wcmqtt import simple
+    simple.socket = types.SimpleNamespace( socket      = ShimSocket,
+                                           getaddrinfo = socket.getaddrinfo )
+
+# ============================================================================
+# ===( Broker )===============================================================
+# ============================================================================
+
+def _packet(op, body) :
+    hdr = bytearray([op])
+    sz  = len(body)
+    while True :
+        b   = sz & 0x7F
+        sz >>= 7
+        hdr.append(b | 0x80 if sz else b)
+        if not sz :
+            return bytes(hdr) + body
+
+def _str(s) :
+    return struct.pack('!H', len(s)) + s
+
+def publishPacket(topic, msg, qos=0, pid=0, dup=False) :
+    body = _str(topic) + (struct.pack('!H', pid) if qos else b'') + msg
+    return _packet(0x30 | (qos << 1) | (0x08 if dup else 0), body)
+
+class _Session :
+
+    def __init__(self, clientId) :
+        self.clientId = clientId
+        self.conn     = None
+        self.lock     = threading.Lock()
+        self.subs     = { }
+        self.pending  = [ ]
+        self.pid      = 0
+        self.clean    = True
+
+    def send(self, data) :
+        with self.lock :
+            if not self.conn :
+                return False
+            try :
+                self.conn.sendall(data)
+                return True
+            except OSError :
+                return False
+
+class Broker :
+
+    def __init__(self, port=18883) :
+        self.port         = port
+        self.sessions     = { }
+        self.lock         = threading.Lock()
+        self.conns        = [ ]
+        self.answerPings  = True
+        self.answerSubs   = True
+        self.ackPublishes = True
+        self.ackDelay     = 0       # Seconds before PUBACK, as a network RTT
+        self.refuse       = False   # Connections closed at once, broker down
+        self.connects     = [ ]     # Time of the accepted connections
+        self.received     = [ ]     # (clientId, flags, topic, msg) of PUBLISH
+        self.counts       = { }     # Received packets by type
+        self._srv         = socket.socket()
+        self._srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._srv.bind(('127.0.0.1', port))
+        self._srv.listen(32)
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self) :
+        while True :
+            conn, addr = self._srv.accept()
+            if self.refuse :
+                conn.close()
+                continue
+            self.connects.append(time.time())
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            with self.lock :
+                self.conns.append(conn)
+            threading.Thread(target=self._serve, args=(conn, ), daemon=True).start()
+
+    def killAll(self) :
+        # Drops every client connection, as a broker restart or a WiFi loss
+        with self.lock :
+            conns, self.conns = self.conns, [ ]
+        for conn in conns :
+            try :
+                conn.shutdown(socket.SHUT_RDWR)
+                conn.close()
+            except OSError :
+                pass
+
+    def isOnline(self, clientId) :
+        s = self.sessions.get(clientId)
+        return s is not None and s.conn is not None
+
+    def publish(self, topic, msg, qos=0) :
+        # Sends to the subscribed sessions, QoS 1 messages are kept for
+        # offline persistent sessions.
+        for s in list(self.sessions.values()) :
+            if topic in s.subs :
+                q = min(qos, s.subs[topic])
+                s.pid = s.pid % 0xFFFF + 1
+                pkt   = publishPacket(topic, msg, q, s.pid)
+                if not s.send(pkt) and q and not s.clean :
+                    s.pending.append(pkt)
+
+    def sendRaw(self, clientId, data) :
+        return self.sessions[clientId].send(data)
+
+    def _recvExact(self, conn, n) :
+        data = b''
+        while len(data) < n :
+            x = conn.recv(n - len(data))
+            if not x :
+                raise OSError('closed')
+            data += x
+        return data
+
+    def _serve(self, conn) :
+        session = None
+        try :
+            while True :
+                op = self._recvExact(conn, 1)[0]
+                sz = sh = 0
+                while True :
+                    b   = self._recvExact(conn, 1)[0]
+                    sz |= (b & 0x7F) << sh
+                    sh += 7
+                    if not b & 0x80 :
+                        break
+                body = self._recvExact(conn, sz)
+                typ  = op & 0xF0
+                self.counts[typ] = self.counts.get(typ, 0) + 1
+                if typ == 0x10 :
+                    session = self._connect(conn, body)
+                elif typ == 0x30 :
+                    self._published(session, op, body)
+                elif typ == 0x80 :
+                    self._subscribe(session, body)
+                elif typ == 0xC0 :
+                    if self.answerPings :
+                        session.send(b'\xd0\x00')
+                elif typ == 0xE0 :
+                    break
+        except OSError :
+            pass
+        if session and session.conn is conn :
+            with session.lock :
+                session.conn = None
+            if session.clean :
+                self.sessions.pop(session.clientId, None)
+        try :
+            conn.close()
+        except OSError :
+            pass
+
+    def _connect(self, conn, body) :
+        flags    = body[7]
+        clean    = bool(flags & 0x02)
+        n        = struct.unpack('!H', body[10:12])[0]
+        clientId = body[12:12+n].decode()
+        session  = self.sessions.get(clientId)
+        present  = session is not None and not clean
+        if not present :
+            session = _Session(clientId)
+            self.sessions[clientId] = session
+        session.clean = clean
+        with session.lock :
+            session.conn = conn
+            conn.sendall(bytes([0x20, 0x02, 1 if present else 0, 0]))
+            pending, session.pending = session.pending, [ ]
+            for pkt in pending :
+                conn.sendall(pkt)
+        return session
+
+    def _published(self, session, op, body) :
+        n     = struct.unpack('!H', body[:2])[0]
+        topic = body[2:2+n]
+        pos   = 2 + n
+        qos   = (op >> 1) & 3
+        if qos :
+            pid  = body[pos:pos+2]
+            pos += 2
+        msg = body[pos:]
+        self.received.append((session.clientId, op & 0x0F, topic, msg))
+        if qos and self.ackPublishes :
+            if self.ackDelay :
+                threading.Timer(self.ackDelay, session.send, (b'\x40\x02' + pid, )).start()
+            else :
+                session.send(b'\x40\x02' + pid)
+        self.publish(topic, msg, qos)
+
+    def _subscribe(self, session, body) :
+        pid     = body[:2]
+        pos     = 2
+        granted = b''
+        while pos < len(body) :
+            n     = struct.unpack('!H', body[pos:pos+2])[0]
+            topic = body[pos+2:pos+2+n]
+            qos   = min(body[pos+2+n], 1)
+            session.subs[topic] = qos
+            granted += bytes([qos])
+            pos += 3 + n
+        if self.answerSubs :
+            session.send(_packet(0x90, pid + granted))
+
+def waitFor(cond, timeout=5.0) :
+    t = time.time()
+    while not cond() :
+        if time.time() - t > timeout :
+            return False
+        time.sleep(0.005)
+    return True
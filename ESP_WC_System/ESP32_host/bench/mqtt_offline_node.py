@@ -0,0 +1,115 @@
+"""
+Node offline for a while, as ESP8266_nodes/wc1/main.py connects (stable
+client id, wcmqtt.robust, check_msg() every 10 ms) :
+- commands published with QoS 1 by the PC meanwhile : delivered on
+  reconnection with clean_session=False and a QoS 1 subscription, lost
+  with a clean session,
+- a command sent as PC_host/mqtt_handler.py publish_command does, by a
+  client connected to the broker : delivered after the reconnection with
+  QoS 1, lost with QoS 0,
+- statuses published with QoS 1 meanwhile : delivered in order on
+  reconnection, the oldest dropped past max_queue,
+- statuses kept in the queue file across a new client (node reboot).
+"""
+
+import json, os, tempfile, time
+from   mqtt_broker import Broker, installSocketShim, waitFor
+
+installSocketShim()
+from wcmqtt import robust, simple
+
+broker = Broker(18206)
+
+def _node(clean, received, **kw) :
+    client = robust.MQTTClient( 'node_wc1', '127.0.0.1', 18206, keepalive=30,
+                                min_delay_ms=100, max_delay_ms=200, **kw )
+    client.log = lambda inReconnect, e : None
+    client.set_callback(lambda topic, msg : received.append(bytes(msg)))
+    client.subscribe(b'wc/wc1/command', qos=1)
+    client.connect(clean_session=clean, timeout=2)
+    return client
+
+def _run(client, cond, timeout=5.0) :
+    t = time.time()
+    while not cond() and time.time() - t < timeout :
+        client.check_msg()
+        time.sleep(0.01)
+    return time.time() - t
+
+def _outage(client, whileDown) :
+    broker.refuse = True
+    broker.killAll()
+    _run(client, lambda : not client.is_connected())
+    waitFor(lambda : not broker.isOnline('node_wc1'))
+    whileDown()
+    broker.refuse = False
+    _run(client, lambda : client.is_connected() and not client.pending())
+
+for clean in (True, False) :
+    received = [ ]
+    client   = _node(clean, received)
+    commands = [ b'%d_on' % (x % 3 + 1) for x in range(5) ]
+    _outage(client, lambda : [ broker.publish(b'wc/wc1/command', c, qos=1) for c in commands ])
+    _run(client, lambda : len(received) == len(commands), 1.0)
+    print( 'clean_session=%-5s : %d of %d commands sent while offline received%s'
+           % (clean, len(received), len(commands),
+              ' in order' if received == commands else '') )
+    client.disconnect()
+
+def _pcCommand(qos) :
+    # Payload and topic of MQTTHandler.publish_command(), from another client
+    pc = simple.MQTTClient('pc_host_bench', '127.0.0.1', 18206)
+    pc.connect()
+    payload = json.dumps({ 'action' : 'on', 'channel' : 1, 'timestamp' : time.time() })
+    pc.publish(b'wc/wc1/command', payload.encode(), qos=qos)
+    pc.disconnect()
+    return payload.encode()
+
+for qos in (1, 0) :
+    received = [ ]
+    client   = _node(False, received)
+    broker.killAll()
+    _run(client, lambda : not client.is_connected())
+    waitFor(lambda : not broker.isOnline('node_wc1'))
+    # The node does not poll meanwhile, so it stays offline while the PC
+    # connects and publishes
+    sent = [ _pcCommand(qos) ]
+    assert not broker.isOnline('node_wc1')
+    _run(client, lambda : received)
+    print( 'publish_command QoS %d : command sent while offline %s'
+           % (qos, 'received after reconnection' if received == sent else 'lost') )
+    client.disconnect()
+
+def _statuses(client, n) :
+    for x in range(n) :
+        client.publish(b'wc/wc1/status', b'%d' % x, qos=1)
+
+received = [ ]
+client   = _node(False, received, max_queue=16, drop_oldest=True)
+del broker.received[:]
+_outage(client, lambda : _statuses(client, 10))
+print( '10 statuses offline  : delivered %s'
+       % [ int(r[3]) for r in broker.received ] )
+del broker.received[:]
+_outage(client, lambda : _statuses(client, 40))
+print( '40 statuses offline  : delivered %s (max_queue 16, drop_oldest)'
+       % [ int(r[3]) for r in broker.received ] )
+client.disconnect()
+
+path   = os.path.join(tempfile.mkdtemp(), 'mqtt_queue.bin')
+client = _node(False, received, queue_file=path)
+broker.refuse = True
+broker.killAll()
+_run(client, lambda : not client.is_connected())
+_statuses(client, 5)
+size = os.path.getsize(path)
+client._close()
+del client
+del broker.received[:]
+broker.refuse = False
+client = _node(False, received, queue_file=path)
+_run(client, lambda : not client.pending())
+print( 'node rebooted offline : %d bytes saved, delivered %s after restart, file %s'
+       % (size, [ int(r[3]) for r in broker.received ],
+          'removed' if not os.path.exists(path) else 'LEFT') )
+client.disconnect()
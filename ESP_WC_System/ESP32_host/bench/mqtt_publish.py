@@ -0,0 +1,50 @@
+"""
+Writes (TCP segments with lwIP) and latency of wcmqtt publishes, until the
+local broker stand-in has received the packets :
+- the ESP32 heartbeat (status JSON on wc/esp32/status), QoS 0 and 1,
+- the status of 3 nodes, one publish() each or one publish_many().
+"""
+
+import json, time
+from   mqtt_broker import Broker, ShimSocket, installSocketShim
+
+installSocketShim()
+from wcmqtt import simple
+
+COUNT  = 500
+broker = Broker(18202)
+client = simple.MQTTClient('bench', '127.0.0.1', 18202)
+client.connect()
+
+status = json.dumps( { "status"    : "online",
+                       "ip"        : "192.168.1.50",
+                       "uptime"    : 12345,
+                       "device_id" : "esp32_test_30aea4071234",
+                       "heartbeat" : 2469 } ).encode()
+nodes  = [ (('wc/wc%d/status' % i).encode(), b'{"1": 0, "2": 1, "3": 0}') for i in (1, 2, 3) ]
+
+def _measure(name, func, packets) :
+    del broker.received[:]
+    writes = ShimSocket.writes
+    t      = time.perf_counter()
+    for x in range(COUNT) :
+        func()
+        n = (x + 1) * packets
+        while len(broker.received) < n :
+            time.sleep(0)
+    t = (time.perf_counter() - t) / COUNT
+    print( '%-32s : %4.1f writes, %5.1f us'
+           % (name, (ShimSocket.writes - writes) / COUNT, t * 1e6) )
+
+_measure('heartbeat, qos 0',
+         lambda : client.publish(b'wc/esp32/status', status), 1)
+_measure('heartbeat, qos 1',
+         lambda : client.publish(b'wc/esp32/status', status, qos=1), 1)
+def _publishEach() :
+    for topic, msg in nodes :
+        client.publish(topic, msg)
+_measure('3 node statuses, publish()', _publishEach, 3)
+if hasattr(client, 'publish_many') :
+    _measure('3 node statuses, publish_many()',
+             lambda : client.publish_many(nodes), 3)
+client.disconnect()
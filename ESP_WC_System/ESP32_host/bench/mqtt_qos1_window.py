@@ -0,0 +1,79 @@
+"""
+QoS 1 publishes with a 20 ms PUBACK delay (broker stand-in), the control
+loop calling check_msg() every millisecond :
+- messages per second and longest publish() call, wcmqtt.simple waiting
+  for each PUBACK, wcmqtt.nonblocking with in-flight windows of 1 to 8,
+- acknowledgements lost for 1 s : messages sent again with DUP.
+"""
+
+import time
+from   mqtt_broker import Broker, installSocketShim, waitFor
+
+installSocketShim()
+from wcmqtt import simple, nonblocking
+
+COUNT  = 200
+TOPIC  = b'wc/wc1/status'
+broker = Broker(18204)
+broker.ackDelay = 0.02
+
+def _simple() :
+    client  = simple.MQTTClient('bench', '127.0.0.1', 18204)
+    client.connect()
+    longest = 0
+    t       = time.perf_counter()
+    for x in range(COUNT) :
+        t0 = time.perf_counter()
+        client.publish(TOPIC, b'{"1": 0, "2": 1, "3": 0}', qos=1)
+        longest = max(longest, time.perf_counter() - t0)
+        time.sleep(0.001)
+    t = time.perf_counter() - t
+    client.disconnect()
+    return COUNT / t, longest
+
+def _nonblocking(window) :
+    client  = nonblocking.MQTTClient('bench', '127.0.0.1', 18204, max_inflight=window)
+    client.connect()
+    longest = 0
+    sent    = 0
+    t       = time.perf_counter()
+    while sent < COUNT or client.pending() :
+        if sent < COUNT :
+            t0 = time.perf_counter()
+            if client.publish(TOPIC, b'{"1": 0, "2": 1, "3": 0}', qos=1) :
+                sent += 1
+            longest = max(longest, time.perf_counter() - t0)
+        client.check_msg()
+        time.sleep(0.001)
+    t = time.perf_counter() - t
+    client.disconnect()
+    return COUNT / t, longest
+
+rate, longest = _simple()
+print('simple           : %5.0f msg/s, longest publish %6.2f ms' % (rate, longest * 1e3))
+for window in (1, 4, 8) :
+    rate, longest = _nonblocking(window)
+    print( 'nonblocking, %d   : %5.0f msg/s, longest publish %6.2f ms'
+           % (window, rate, longest * 1e3) )
+
+broker.ackDelay     = 0
+broker.ackPublishes = False
+del broker.received[:]
+client = nonblocking.MQTTClient('bench', '127.0.0.1', 18204, retry_ms=300)
+client.connect()
+for x in range(10) :
+    client.publish(TOPIC, b'%d' % x, qos=1)
+t = time.time()
+while time.time() - t < 1 :
+    client.check_msg()
+    time.sleep(0.01)
+broker.ackPublishes = True
+def _drained() :
+    client.check_msg()
+    return not client.pending()
+waitFor(_drained)
+dups = sum(1 for r in broker.received if r[1] & 0x08)
+msgs = sorted(set(r[3] for r in broker.received), key=int)
+print( 'acks lost 1 s   : %d sent, %d with DUP, %d distinct messages, %d pending'
+       % (len(broker.received), dups, len(msgs), client.pending()) )
+client.disconnect()
@@ -0,0 +1,114 @@
+"""
+wcmqtt.robust supervising its connection to the local broker stand-in,
+check_msg() called every 10 ms, keepalive 2 s, ping timeout 1 s :
+- PINGREQ sent while idle,
+- connections killed : time to reconnect, subscription replayed,
+- dead link (PINGREQ not answered) : time to detect it and reconnect,
+- packet larger than rx_size received : connection dropped and restored,
+- SUBACK not answered, on the replay after a reconnection and for a new
+  subscription : time check_msg() and subscribe() stay blocked,
+- broker down for 5 s : reconnection attempts with backoff and jitter,
+  QoS 1 messages published meanwhile delivered in order.
+"""
+
+import time
+from   mqtt_broker import Broker, installSocketShim, publishPacket
+
+installSocketShim()
+from wcmqtt import robust
+
+broker   = Broker(18205)
+commands = [ ]
+
+def _cb(topic, msg) :
+    commands.append(bytes(msg))
+
+client = robust.MQTTClient( 'wc1', '127.0.0.1', 18205, keepalive=2,
+                            ping_timeout_ms=1000, min_delay_ms=200, max_delay_ms=2000 )
+client.log = lambda inReconnect, e : None
+client.set_callback(_cb)
+client.connect(timeout=2)
+client.subscribe(b'wc/wc1/command')
+
+def _run(cond, timeout=10.0) :
+    t = time.time()
+    while not cond() and time.time() - t < timeout :
+        client.check_msg()
+        time.sleep(0.01)
+    return time.time() - t
+
+pings = broker.counts.get(0xC0, 0)
+_run(lambda : False, 3.0)
+print('idle 3 s          : %d PINGREQ sent' % (broker.counts.get(0xC0, 0) - pings))
+
+for x in range(3) :
+    connects = len(broker.connects)
+    broker.killAll()
+    t = _run(lambda : len(broker.connects) > connects and broker.isOnline('wc1')
+                      and b'wc/wc1/command' in broker.sessions['wc1'].subs)
+    del commands[:]
+    broker.publish(b'wc/wc1/command', b'1_on')
+    _run(lambda : commands, 2.0)
+    print('connection killed : reconnected and subscribed in %4.0f ms, command %s'
+          % (t * 1e3, 'received' if commands == [b'1_on'] else 'LOST'))
+
+broker.answerPings = False
+connects = len(broker.connects)
+t = _run(lambda : len(broker.connects) > connects)
+broker.answerPings = True
+print('dead link         : detected and reconnected in %4.0f ms' % (t * 1e3))
+
+_run(lambda : client.is_connected())
+connects = len(broker.connects)
+broker.sendRaw('wc1', publishPacket(b'wc/wc1/command', b'x' * 2 * len(client.rx_buf)))
+t = _run(lambda : len(broker.connects) > connects and broker.isOnline('wc1'))
+del commands[:]
+broker.publish(b'wc/wc1/command', b'2_on')
+_run(lambda : commands, 2.0)
+print('oversized packet  : reconnected in %4.0f ms, next command %s'
+      % (t * 1e3, 'received' if commands == [b'2_on'] else 'LOST'))
+
+_run(lambda : client.is_connected())
+broker.answerSubs = False
+broker.killAll()
+worst = 0
+t0    = time.time()
+while time.time() - t0 < 3.0 :
+    t = time.time()
+    client.check_msg()
+    worst = max(worst, time.time() - t)
+    time.sleep(0.01)
+broker.answerSubs = True
+_run(lambda : client.is_connected())
+broker.answerSubs = False
+t = time.time()
+client.subscribe(b'wc/wc1/config')
+t = time.time() - t
+lost = not client.is_connected()
+broker.answerSubs = True
+_run(lambda : client.is_connected() and b'wc/wc1/config' in broker.sessions['wc1'].subs)
+print( 'SUBACK lost       : check_msg() blocked %4.0f ms at most, subscribe() %4.0f ms%s, %s'
+       % ( worst * 1e3, t * 1e3, ' (connection lost)' if lost else '',
+           'subscribed again' if b'wc/wc1/config' in broker.sessions['wc1'].subs else 'NOT SUBSCRIBED' ) )
+
+_run(lambda : client.is_connected())
+broker.refuse = True
+broker.killAll()
+t0 = time.time()
+for x in range(10) :
+    client.publish(b'wc/wc1/status', b'%d' % x, qos=1)
+attempts = [ ]
+orig = client.connect
+def _connect(*args) :
+    attempts.append(time.time() - t0)
+    return orig(*args)
+client.connect = _connect
+del broker.received[:]
+_run(lambda : False, 5.0)
+broker.refuse = False
+_run(lambda : not client.pending() and client.is_connected())
+client.connect = orig
+print('broker down 5 s   : attempts at %s s' % ', '.join('%.2f' % a for a in attempts))
+msgs = [ int(r[3]) for r in broker.received ]
+print('                    queued messages delivered : %s' % msgs)
+client.disconnect()
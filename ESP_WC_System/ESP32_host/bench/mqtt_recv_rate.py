@@ -0,0 +1,84 @@
+"""
+Messages received per second by wcmqtt clients polling with check_msg(),
+from the local broker stand-in, and heap bytes allocated to receive a
+message (still alive when the callback is called, CPython tracemalloc) :
+- wcmqtt.simple : setblocking toggles, byte reads, bytes topic and message,
+- wcmqtt.nonblocking : receive buffer, memoryview topic and message,
+- time for check_msg() to take a lone PINGRESP (2 bytes) once received,
+  the client connected with a 5 s timeout.
+"""
+
+import threading, time, tracemalloc
+from   mqtt_broker import Broker, installSocketShim, publishPacket
+
+installSocketShim()
+from wcmqtt import simple, nonblocking
+
+COUNT  = 20000
+TOPIC  = b'wc/bench/command'
+broker = Broker(18201)
+
+def _client(clientClass, cb) :
+    client = clientClass('bench', '127.0.0.1', 18201)
+    client.set_callback(cb)
+    client.connect()
+    client.subscribe(TOPIC)
+    return client
+
+def _recvRate(clientClass, size) :
+    received = [ 0 ]
+    def _cb(topic, msg) :
+        received[0] += 1
+    client = _client(clientClass, _cb)
+    blob   = publishPacket(TOPIC, b'x' * size) * 100
+    def _send() :
+        for x in range(COUNT // 100) :
+            broker.sendRaw('bench', blob)
+    t = time.perf_counter()
+    threading.Thread(target=_send).start()
+    while received[0] < COUNT :
+        client.check_msg()
+    t = time.perf_counter() - t
+    client.disconnect()
+    return COUNT / t
+
+def _allocs(clientClass, size) :
+    # Heap bytes allocated by wait_msg() and still alive when it calls the
+    # callback, the messages being already received by the socket
+    state = [ 0, 0 ]
+    def _cb(topic, msg) :
+        state[0] += tracemalloc.get_traced_memory()[0] - state[1]
+    client = _client(clientClass, _cb)
+    blob   = publishPacket(TOPIC, b'x' * size) * 100
+    tracemalloc.start()
+    for x in range(20) :
+        broker.sendRaw('bench', blob)
+        time.sleep(0.02)
+        for y in range(100) :
+            state[1] = tracemalloc.get_traced_memory()[0]
+            client.wait_msg()
+    tracemalloc.stop()
+    client.disconnect()
+    return state[0] / 2000
+
+def _pingLatency() :
+    client = nonblocking.MQTTClient('bench', '127.0.0.1', 18201)
+    client.connect(timeout=5)
+    worst = 0
+    for x in range(20) :
+        client.ping()
+        time.sleep(0.01)
+        t = time.perf_counter()
+        assert client.check_msg() == 0xD0
+        worst = max(worst, time.perf_counter() - t)
+    client.disconnect()
+    return worst
+
+print('PINGRESP, nonblocking : check_msg() returns in %.2f ms at most' % (_pingLatency() * 1e3))
+for size in (16, 64, 512) :
+    for clientClass, name in ( (simple.MQTTClient,      'simple     '),
+                               (nonblocking.MQTTClient, 'nonblocking') ) :
+        rate   = _recvRate(clientClass, size)
+        allocs = _allocs(clientClass, size)
+        print( '%3d B messages, %s : %7.0f msg/s, %4.0f bytes allocated per message'
+               % (size, name, rate, allocs) )
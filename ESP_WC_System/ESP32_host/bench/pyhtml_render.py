@@ -0,0 +1,34 @@
+"""
+Rendering of www/test.pyhtml (py bloc, nested for loops, if/elif/else) :
+- template compiled for each page, as WriteResponsePyHTMLFile did,
+- template taken from the MicroWebTemplate.FromFile cache,
+- whole GET on loopback, the page rendered by the server.
+"""
+
+import os
+from   benchutil        import HOST_DIR, startServer, httpGet, timeIt
+from   microWebSrv      import MicroWebSrv
+from   microWebTemplate import MicroWebTemplate
+
+COUNT    = 500
+filepath = os.path.join(HOST_DIR, 'www', 'test.pyhtml')
+
+def _compiled() :
+    with open(filepath, 'r') as file :
+        code = file.read()
+    tmpl = MicroWebTemplate(code, escapeStrFunc=MicroWebSrv.HTMLEscape, filepath=filepath)
+    return tmpl.Execute(None, None)
+
+def _cached() :
+    return MicroWebTemplate.FromFile(filepath, MicroWebSrv.HTMLEscape).Execute(None, None)
+
+page = _compiled()
+assert _cached() == page
+print('test.pyhtml, %d bytes rendered :' % len(page))
+print('  compiled for each page : %4.0f us' % (timeIt(_compiled, COUNT) * 1e6))
+print('  FromFile cache         : %4.0f us' % (timeIt(_cached,   COUNT) * 1e6))
+
+startServer(port=18095)
+status, headers, data = httpGet('/test.pyhtml', port=18095)
+assert status == 200 and data.decode() == page
+print('  GET /test.pyhtml       : %4.0f us' % (timeIt(lambda : httpGet('/test.pyhtml', port=18095), COUNT) * 1e6))
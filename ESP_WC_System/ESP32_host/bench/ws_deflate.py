@@ -0,0 +1,61 @@
+"""
+permessage-deflate on typical dashboard status messages : compression
+ratio and CPU time per message for some window sizes, with and without
+context takeover, then a negotiated echo over loopback.
+"""
+
+import json, time, zlib
+from   benchutil import startServer, WSClient
+
+def _status(i) :
+    return json.dumps( { 'type'     : 'status',
+                         'uptime'   : 86400 + i * 5,
+                         'rssi'     : -60 - i % 7,
+                         'channels' : [ { 'id'    : c,
+                                          'name'  : 'WC %d' % c,
+                                          'busy'  : (c + i) % 3 == 0,
+                                          'since' : 1700000000 + i * 5 + c } for c in range(8) ] } ).encode()
+
+messages = [ _status(i) for i in range(200) ]
+rawSize  = sum(len(m) for m in messages)
+print('%d status messages, %d bytes on average' % (len(messages), rawSize // len(messages)))
+
+for wbits in (9, 10, 12, 15) :
+    for takeover in (True, False) :
+        comp = zlib.compressobj(-1, zlib.DEFLATED, -wbits)
+        size = 0
+        t    = time.perf_counter()
+        for m in messages :
+            if not takeover :
+                comp = zlib.compressobj(-1, zlib.DEFLATED, -wbits)
+            size += len(comp.compress(m) + comp.flush(zlib.Z_SYNC_FLUSH)) - 4
+        t = (time.perf_counter() - t) / len(messages)
+        print( 'window %2d bits, context takeover %-5s : ratio %4.1f %%, %5.1f us per message'
+               % (wbits, takeover, size * 100.0 / rawSize, t * 1e6) )
+
+PORT     = 18130
+sessions = [ ]
+
+def _acceptWS(webSocket, httpClient) :
+    sessions.append(webSocket)
+    webSocket.RecvTextCallback = lambda ws, msg : ws.SendText(msg)
+
+startServer(port=PORT, AcceptWebSocketCallback=_acceptWS, WebSocketDeflate=True)
+client = WSClient(PORT, headers='Sec-WebSocket-Extensions: permessage-deflate; client_max_window_bits\r\n')
+ext    = [ l for l in client.response.split('\r\n') if l.lower().startswith('sec-websocket-extensions') ]
+print(ext[0] if ext else 'permessage-deflate not negotiated')
+comp   = zlib.compressobj(-1, zlib.DEFLATED, -10)
+decomp = zlib.decompressobj(-10)
+sent   = 0
+wire   = 0
+for m in messages :
+    data = comp.compress(m) + comp.flush(zlib.Z_SYNC_FLUSH)
+    client.send(0x1, data[:-4], rsv=0x40)
+    b1, data = client.recv()
+    wire += len(data)
+    if b1 & 0x40 :
+        data = decomp.decompress(data + b'\x00\x00\xff\xff')
+    if data != m :
+        raise Exception('Echo mismatch')
+    sent += len(m)
+print('echo ok, server sent %d bytes for %d bytes of messages' % (wire, sent))
@@ -0,0 +1,66 @@
+"""
+Fan-out latency of a status broadcast to 1 to 20 WebSocket clients :
+SendText called on each client (JSON encoded for each one) compared to
+MicroWebSocketHub.BroadcastText (frame encoded once). Also checks that a
+client not reading anymore is dropped instead of blocking the others.
+"""
+
+import json, threading, time
+from   benchutil      import startServer, WSClient, timeIt
+from   microWebSocket import MicroWebSocketHub
+
+PORT = 18110
+hub  = MicroWebSocketHub(sendTimeoutMs=200)
+
+def _acceptWS(webSocket, httpClient) :
+    hub.Join(webSocket, 'status')
+
+state = { 'channels' : [ { 'id'    : i,
+                           'name'  : 'WC %d' % i,
+                           'busy'  : i % 2 == 0,
+                           'since' : 1700000000 + i } for i in range(8) ],
+          'rssi'     : -61 }
+
+def _drain(client) :
+    try :
+        while client.sock.recv(65536) :
+            pass
+    except :
+        pass
+
+startServer(port=PORT, AcceptWebSocketCallback=_acceptWS)
+clients = [ ]
+
+def _sendTextLoop() :
+    for webSocket in hub.GetMembers('status') :
+        webSocket.SendText(json.dumps(state))
+
+def _broadcast() :
+    hub.BroadcastText('status', json.dumps(state))
+
+print('status message : %d bytes' % len(json.dumps(state)))
+for count in (1, 2, 5, 10, 20) :
+    while len(clients) < count :
+        client = WSClient(PORT)
+        clients.append(client)
+        threading.Thread(target=_drain, args=(client, ), daemon=True).start()
+    time.sleep(0.1)
+    tLoop = timeIt(_sendTextLoop, 300)
+    tHub  = timeIt(_broadcast, 300)
+    print( '%2d clients : SendText loop %7.1f us, hub broadcast %7.1f us'
+           % (count, tLoop * 1e6, tHub * 1e6) )
+
+# A client not reading anymore fills its socket buffers and is dropped
+slow = WSClient(PORT)
+while len(hub.GetMembers('status')) <= len(clients) :
+    time.sleep(0.01)
+t       = time.perf_counter()
+maxTime = 0
+for x in range(2000) :
+    t1 = time.perf_counter()
+    n  = hub.BroadcastText('status', json.dumps(state) + ' ' * 4000)
+    maxTime = max(maxTime, time.perf_counter() - t1)
+    if len(hub.GetMembers('status')) == len(clients) :
+        break
+print( 'client not reading dropped after %.2f s (longest broadcast %.0f ms), %d clients left'
+       % (time.perf_counter() - t, maxTime * 1e3, len(hub.GetMembers('status'))) )
@@ -0,0 +1,71 @@
+"""
+RAM of WebSocket sessions with message buffers taken from a shared pool :
+- buffers held by idle sessions,
+- sessions admitted within mws.WebSocketMemoryBudget before the 503,
+- echo of large messages received by all the sessions at once.
+"""
+
+import os, time
+from   benchutil      import startServer, WSClient
+from   microWebSocket import MicroWebSocket
+
+RECV_LEN = 4096
+BUDGET   = 32 * 1024
+
+sessions = [ ]
+
+def _acceptWS(webSocket, httpClient) :
+    sessions.append(webSocket)
+    webSocket.RecvBinaryCallback = lambda ws, data : ws.SendBinary(data)
+
+startServer( port                    = 18160,
+             AcceptWebSocketCallback = _acceptWS,
+             WebSocketPolled         = True,
+             MaxWebSocketRecvLen     = RECV_LEN )
+startServer( port                    = 18161,
+             AcceptWebSocketCallback = _acceptWS,
+             WebSocketPolled         = True,
+             MaxWebSocketRecvLen     = RECV_LEN,
+             WebSocketMemoryBudget   = BUDGET )
+
+clients = [ WSClient(18160) for x in range(20) ]
+for c in clients :
+    c.send(0x2, os.urandom(RECV_LEN // 2))
+    c.recv()
+held = 0
+for ws in sessions :
+    for buf in (ws._rxBuf, ws._sendBuf, ws._msgBuf) :
+        held += len(buf) if buf else 0
+print( '20 idle sessions after a %d bytes message : %d bytes of buffers per session (MaxWebSocketRecvLen %d)'
+       % (RECV_LEN // 2, held / 20, RECV_LEN) )
+for c in clients :
+    c.close()
+time.sleep(0.5)
+
+clients = [ ]
+while True :
+    c = WSClient(18161)
+    if not c.response.startswith('HTTP/1.1 101') :
+        print( 'budget %d bytes : %d sessions admitted, then %s'
+               % (BUDGET, len(clients), c.response.split('\r\n')[0]) )
+        c.close()
+        break
+    clients.append(c)
+
+data = os.urandom(RECV_LEN // 2)
+for c in clients :
+    c.send(0x2, data)
+echoed = tryLater = 0
+for c in clients :
+    try :
+        b1, payload = c.recv()
+        if payload == data :
+            echoed += 1
+        elif b1 & 0x0F == 0x8 and payload[:2] == b'\x03\xf5' :
+            tryLater += 1
+    except :
+        pass
+print( '%d large messages at once : %d echoed, %d closed with 1013, %d bytes used of the budget'
+       % (len(clients), echoed, tryLater, MicroWebSocket._memUsed) )
+for c in clients :
+    c.close()
@@ -0,0 +1,50 @@
+"""
+Concurrent WebSocket sessions, a thread each (mws.WebSocketThreaded) or all
+served by one polling thread (mws.WebSocketPolled) :
+- threads of the process with the sessions open,
+- echo round trip of a message sent on every session at once.
+"""
+
+import os, time
+from   benchutil import startServer, WSClient
+
+def _threadsCount() :
+    with open('/proc/self/status') as f :
+        for line in f :
+            if line.startswith('Threads:') :
+                return int(line.split()[1])
+    return 0
+
+def _acceptWS(webSocket, httpClient) :
+    webSocket.RecvBinaryCallback = lambda ws, data : ws.SendBinary(data)
+
+startServer(port=18140, AcceptWebSocketCallback=_acceptWS, WebSocketPolled=False)
+startServer(port=18141, AcceptWebSocketCallback=_acceptWS, WebSocketPolled=True)
+
+def _sessions(port, count, rounds=50) :
+    threads = _threadsCount()
+    clients = [ WSClient(port) for x in range(count) ]
+    data    = os.urandom(64)
+    for c in clients :
+        c.send(0x2, data)
+        c.recv()
+    time.sleep(0.1)
+    threads = _threadsCount() - threads
+    t = time.perf_counter()
+    for x in range(rounds) :
+        for c in clients :
+            c.send(0x2, data)
+        for c in clients :
+            if c.recv()[1] != data :
+                raise Exception('Bad echo')
+    t = (time.perf_counter() - t) / rounds
+    for c in clients :
+        c.close()
+    time.sleep(0.3)
+    return threads, t
+
+for count in (1, 10, 50, 100) :
+    for port, name in ((18140, 'threaded'), (18141, 'polled  ')) :
+        threads, t = _sessions(port, count)
+        print('%3d sessions %s : %3d more threads, all echoed in %7.1f us'
+              % (count, name, threads, t * 1e6))
@@ -0,0 +1,71 @@
+"""
+WebSocket messages per second on loopback :
+- SendText/SendBinary from the server to a client reading in a thread,
+- echo round trips (client frame, server callback, server frame).
+"""
+
+import os, threading, time
+from   benchutil import startServer, WSClient
+
+PORT      = 18120
+receivers = [ ]
+
+def _acceptWS(webSocket, httpClient) :
+    receivers.append(webSocket)
+    webSocket.RecvBinaryCallback = lambda ws, data : ws.SendBinary(data)
+
+startServer(port=PORT, AcceptWebSocketCallback=_acceptWS, MaxWebSocketRecvLen=128*1024)
+
+def _sendRate(size, duration=1.0) :
+    del receivers[:]
+    client = WSClient(PORT)
+    while len(receivers) == 0 :
+        time.sleep(0.01)
+    webSocket = receivers.pop()
+    received  = [ 0 ]
+    def _drain() :
+        try :
+            while True :
+                client.recv()
+                received[0] += 1
+        except :
+            pass
+    threading.Thread(target=_drain, daemon=True).start()
+    data  = os.urandom(size)
+    count = 0
+    t     = time.perf_counter()
+    while time.perf_counter() - t < duration :
+        if not webSocket.SendBinary(data) :
+            client.close()
+            return None
+        count += 1
+    rate = count / (time.perf_counter() - t)
+    time.sleep(0.2)
+    client.close()
+    return rate, received[0] == count
+
+def _echoRate(size, duration=1.0) :
+    client = WSClient(PORT)
+    data   = os.urandom(size)
+    count  = 0
+    t      = time.perf_counter()
+    try :
+        while time.perf_counter() - t < duration :
+            client.send(0x2, data)
+            if client.recv()[1] != data :
+                return None
+            count += 1
+    except :
+        return None
+    finally :
+        client.close()
+    return count / (time.perf_counter() - t)
+
+for size in (32, 1024, 16*1024, 100*1024) :
+    r = _sendRate(size)
+    if r is None :
+        print('%6d B : send refused' % size)
+    else :
+        print('%6d B : server send %8.0f msg/s %s' % (size, r[0], '' if r[1] else '(messages lost)'))
+    r = _echoRate(size)
+    print('%6d B : echo round trip %6.0f msg/s' % (size, r) if r else '%6d B : echo failed' % size)
@@ -0,0 +1,253 @@
+import struct
+from select import poll, POLLIN
+from . import simple
+from .simple import MQTTException
+
+try:
+    from time import ticks_ms, ticks_add, ticks_diff
+except ImportError:
+    from time import monotonic
+
+    def ticks_ms():
+        return int(monotonic() * 1000)
+
+    def ticks_add(a, b):
+        return a + b
+
+    def ticks_diff(a, b):
+        return a - b
+
+
+# MQTTClient receiving in a buffer kept for the whole connection. Packets
+# are parsed as their bytes arrive, so check_msg() never blocks, even in
+# the middle of a packet. Reads are only done when poll() reports data,
+# the socket being non-blocking just while reading. Topic and message are given
+# to the callback as memoryview slices of the receive buffer: they are
+# only valid during the call, use bytes(topic) to keep them.
+#
+# QoS 1 publishes do not wait for their PUBACK: up to max_inflight of them
+# are sent and tracked by packet id, the next ones wait in a queue of
+# max_queue messages. check_msg() matches the PUBACK, sends the queued
+# messages in order and sends again with DUP those not acknowledged after
+# retry_ms, as connect() does for all of them. With drop_oldest, a full
+# queue makes room for a new message by dropping its oldest one.
+class MQTTClient(simple.MQTTClient):
+    def __init__(
+        self,
+        *args,
+        rx_size=1024,
+        max_inflight=4,
+        max_queue=16,
+        retry_ms=5000,
+        drop_oldest=False,
+        **kw
+    ):
+        super().__init__(*args, **kw)
+        self.rx_buf = bytearray(rx_size)
+        self.rx_mv = memoryview(self.rx_buf)
+        self.rx_start = 0
+        self.rx_end = 0
+        self.poller = None
+        self.timeout = None
+        self.ack_pid = 0
+        self.sub_pid = 0
+        self.puback = bytearray(b"\x40\x02\0\0")
+        self.max_inflight = max_inflight
+        self.max_queue = max_queue
+        self.retry_ms = retry_ms
+        self.drop_oldest = drop_oldest
+        self.inflight = {}
+        self.queue = []
+        self.seq = 0
+
+    def connect(self, clean_session=True, timeout=None):
+        self.timeout = timeout
+        ret = super().connect(clean_session, timeout)
+        self.rx_start = 0
+        self.rx_end = 0
+        self.poller = poll()
+        self.poller.register(self.sock, POLLIN)
+        # Dict order is not the insertion one on MicroPython
+        for pid in sorted(self.inflight, key=lambda pid: self.inflight[pid][2]):
+            self._send_inflight(pid, True)
+        self._send_queued()
+        return ret
+
+    # Number of QoS 1 messages not acknowledged yet, queued ones included.
+    def pending(self):
+        return len(self.inflight) + len(self.queue)
+
+    def _new_pid(self):
+        while 1:
+            pid = super()._new_pid()
+            if pid not in self.inflight:
+                return pid
+
+    def _send_inflight(self, pid, dup):
+        entry = self.inflight[pid]
+        pkt = entry[0]
+        if dup:
+            pkt[0] |= 0x08
+        entry[1] = ticks_ms()
+        self.sock.write(pkt)
+
+    def _send_queued(self):
+        while self.queue and len(self.inflight) < self.max_inflight:
+            topic, msg, retain = self.queue.pop(0)
+            pid = self._new_pid()
+            pkt = bytearray(9 + len(topic) + len(msg))
+            n = self._put_publish(pkt, 0, topic, len(msg), retain, 1, pid)
+            pkt[n : n + len(msg)] = msg
+            self.seq += 1
+            self.inflight[pid] = [memoryview(pkt)[: n + len(msg)], 0, self.seq]
+            self._send_inflight(pid, False)
+
+    def _retry(self):
+        now = ticks_ms()
+        for pid in self.inflight:
+            if ticks_diff(now, self.inflight[pid][1]) >= self.retry_ms:
+                self._send_inflight(pid, True)
+
+    # Receives the available bytes after the ones not parsed yet, waiting
+    # up to timeout ms (-1 forever). Returns False if nothing came.
+    def _fill(self, timeout):
+        if not self.poller.poll(timeout):
+            return False
+        if self.rx_start == self.rx_end:
+            self.rx_start = 0
+            self.rx_end = 0
+        elif self.rx_end == len(self.rx_buf):
+            if not self.rx_start:
+                raise MQTTException("packet larger than rx_size")
+            # Moves the beginning of a packet to the head of the buffer, by
+            # blocks not overlapping, so without copying it in a new object
+            n = self.rx_end - self.rx_start
+            gap = self.rx_start
+            i = 0
+            while i < n:
+                k = min(gap, n - i)
+                self.rx_buf[i : i + k] = self.rx_mv[gap + i : gap + i + k]
+                i += k
+            self.rx_start = 0
+            self.rx_end = n
+        n = self._readinto(self.rx_mv[self.rx_end :])
+        if n is None:
+            return False
+        if not n:
+            raise OSError(-1)
+        self.rx_end += n
+        return True
+
+    # readinto() of a blocking MicroPython socket only returns once the
+    # whole buffer is filled: non-blocking, it takes the bytes received.
+    # Writes keep the timeout given to connect().
+    def _readinto(self, mv):
+        sock = self.sock
+        sock.setblocking(False)
+        try:
+            return sock.readinto(mv)
+        finally:
+            if self.timeout is None:
+                sock.setblocking(True)
+            else:
+                sock.settimeout(self.timeout)
+
+    # Processes the packet at the head of the receive buffer and returns
+    # its first byte, or None if it is not completely received yet.
+    def _parse(self):
+        buf = self.rx_buf
+        end = self.rx_end
+        i = self.rx_start
+        sz = 0
+        sh = 0
+        while 1:
+            i += 1
+            if i >= end:
+                return None
+            b = buf[i]
+            sz |= (b & 0x7F) << sh
+            if not b & 0x80:
+                break
+            sh += 7
+        i += 1
+        if end - i < sz:
+            if i + sz - self.rx_start > len(buf):
+                raise MQTTException("packet larger than rx_size")
+            return None
+        op = buf[self.rx_start]
+        self.rx_start = i + sz
+        self._process(op, i, sz)
+        return op
+
+    def _process(self, op, i, sz):
+        buf = self.rx_buf
+        typ = op & 0xF0
+        if typ == 0x30:
+            topic_len = buf[i] << 8 | buf[i + 1]
+            topic = self.rx_mv[i + 2 : i + 2 + topic_len]
+            j = i + 2 + topic_len
+            if op & 6:
+                pid = buf[j] << 8 | buf[j + 1]
+                j += 2
+            self.cb(topic, self.rx_mv[j : i + sz])
+            if op & 6 == 2:
+                struct.pack_into("!H", self.puback, 2, pid)
+                self.sock.write(self.puback)
+            elif op & 6 == 4:
+                assert 0
+        elif typ == 0x40:
+            self.ack_pid = buf[i] << 8 | buf[i + 1]
+            if self.inflight.pop(self.ack_pid, None) is not None:
+                self._send_queued()
+        elif typ == 0x90:
+            self.sub_pid = buf[i] << 8 | buf[i + 1]
+            if buf[i + 2] == 0x80:
+                raise MQTTException(0x80)
+
+    # With qos 1, queues the messages to be sent when the in-flight window
+    # allows it. Returns False if the queue is full (the message and the
+    # next ones are not queued) and drop_oldest is not set, True otherwise.
+    def publish(self, topic, msg, retain=False, qos=0):
+        return self.publish_many(((topic, msg),), retain, qos)
+
+    def publish_many(self, msgs, retain=False, qos=0):
+        if qos != 1:
+            return super().publish_many(msgs, retain, qos)
+        for topic, msg in msgs:
+            if len(self.queue) >= self.max_queue:
+                if not self.drop_oldest:
+                    return False
+                self.queue.pop(0)
+            if type(topic) is str:
+                topic = topic.encode()
+            if type(msg) is str:
+                msg = msg.encode()
+            self.queue.append((bytes(topic), bytes(msg), retain))
+        self._send_queued()
+        return True
+
+    def subscribe(self, topic, qos=0):
+        assert self.cb is not None, "Subscribe callback is not set"
+        pid = self._send_subscribe(topic, qos)
+        while self.sub_pid != pid:
+            self.wait_msg()
+
+    # Waits for a whole packet and processes it, returns its first byte.
+    def wait_msg(self):
+        while 1:
+            op = self._parse()
+            if op is not None:
+                return op
+            self._fill(-1)
+
+    # Processes the packets already received without waiting, returns the
+    # first byte of the last one or None if there was none.
+    def check_msg(self):
+        self._fill(0)
+        self._retry()
+        ret = None
+        while 1:
+            op = self._parse()
+            if op is None:
+                return ret
+            ret = op
@@ -0,0 +1,258 @@
+import os
+import struct
+from random import getrandbits
+from . import nonblocking
+from .simple import MQTTException
+from .nonblocking import ticks_ms, ticks_add, ticks_diff
+
+
+# Non-blocking MQTTClient supervising its connection from check_msg(),
+# to be called from the control loop:
+# - PINGREQ once nothing was sent for keepalive / 2 seconds, the link
+#   being considered dead if nothing comes back within ping_timeout_ms,
+# - after a connection loss, reconnects with an exponential backoff from
+#   min_delay_ms to max_delay_ms and a random jitter, then subscribes
+#   again (unless the broker kept the session) while QoS 1 messages not
+#   acknowledged or queued meanwhile are sent in order.
+# connect() may fail at start, check_msg() keeps trying until disconnect()
+# is called. While offline, publish() returns False with qos 0 and QoS 1
+# messages are queued. With queue_file, QoS 1 messages not acknowledged
+# are also written to this file while offline, and queued again by the
+# next client created (after a reboot); the file is removed once they
+# are all acknowledged.
+class MQTTClient(nonblocking.MQTTClient):
+    def __init__(
+        self,
+        *args,
+        min_delay_ms=500,
+        max_delay_ms=60000,
+        ping_timeout_ms=5000,
+        queue_file=None,
+        **kw
+    ):
+        super().__init__(*args, **kw)
+        self.min_delay_ms = min_delay_ms
+        self.max_delay_ms = max_delay_ms
+        self.ping_timeout_ms = ping_timeout_ms
+        self.connected = False
+        self.active = False
+        self.clean_session = True
+        self.connect_timeout = None
+        self.subs = []
+        self.last_tx = 0
+        self.ping_at = None
+        self.delay = 0
+        self.next_try = ticks_ms()
+        self.queue_file = queue_file
+        self.queue_saved = False
+        if queue_file:
+            self._load_queue()
+
+    def log(self, in_reconnect, e):
+        print("mqtt %s: %r" % ("reconnect" if in_reconnect else "connection lost", e))
+
+    def is_connected(self):
+        return self.connected
+
+    def connect(self, clean_session=True, timeout=None):
+        self.clean_session = clean_session
+        self.connect_timeout = timeout
+        self.active = True
+        self._close()
+        # Set before, nonblocking.connect() sends the pending messages
+        self.connected = True
+        try:
+            present = super().connect(clean_session, timeout)
+            self.last_tx = ticks_ms()
+            self.ping_at = None
+        except:
+            self._close()
+            self._backoff()
+            raise
+        self.delay = 0
+        if not present:
+            try:
+                for topic, qos in self.subs:
+                    self._subscribe(topic, qos)
+            except OSError as e:
+                self._lost(e)
+        return present
+
+    # Ends the supervision until the next connect().
+    def disconnect(self):
+        self.active = False
+        if self.connected:
+            self.connected = False
+            try:
+                super().disconnect()
+            except OSError:
+                pass
+            self._close()
+
+    # Subscriptions are kept to be replayed after a reconnection.
+    def subscribe(self, topic, qos=0):
+        if type(topic) is str:
+            topic = topic.encode()
+        self.subs = [sub for sub in self.subs if sub[0] != topic]
+        self.subs.append((topic, qos))
+        if self.connected:
+            try:
+                self.last_tx = ticks_ms()
+                self._subscribe(topic, qos)
+            except OSError as e:
+                self._lost(e)
+
+    # As nonblocking.subscribe(), but the SUBACK is waited for at most
+    # ping_timeout_ms, the link being considered dead past it.
+    def _subscribe(self, topic, qos):
+        assert self.cb is not None, "Subscribe callback is not set"
+        pid = self._send_subscribe(topic, qos)
+        deadline = ticks_add(ticks_ms(), self.ping_timeout_ms)
+        while self.sub_pid != pid:
+            if self._parse() is None:
+                left = ticks_diff(deadline, ticks_ms())
+                if left <= 0:
+                    raise OSError("suback timeout")
+                self._fill(left)
+
+    def publish_many(self, msgs, retain=False, qos=0):
+        if qos != 1 and not self.connected:
+            return False
+        try:
+            ret = super().publish_many(msgs, retain, qos) is not False
+        except OSError as e:
+            # Saves the messages not acknowledged
+            self._lost(e)
+            return qos == 1
+        if qos == 1 and not self.connected:
+            self._save_queue()
+        return ret
+
+    def ping(self):
+        super().ping()
+        self.ping_at = self.last_tx = ticks_ms()
+
+    def check_msg(self):
+        if not self.connected:
+            if not self.active or ticks_diff(ticks_ms(), self.next_try) < 0:
+                return None
+            try:
+                self.connect(self.clean_session, self.connect_timeout)
+            except Exception as e:
+                self.log(True, e)
+                return None
+            if not self.connected:
+                return None
+        try:
+            ret = super().check_msg()
+            self._keepalive()
+            if self.queue_saved and not self.pending():
+                self._remove_queue()
+            return ret
+        except (OSError, MQTTException) as e:
+            # A packet larger than rx_size cannot be skipped: the connection
+            # is dropped as a lost one
+            self._lost(e)
+            return None
+
+    def _keepalive(self):
+        if self.keepalive:
+            now = ticks_ms()
+            if self.ping_at is not None:
+                if ticks_diff(now, self.ping_at) > self.ping_timeout_ms:
+                    raise OSError("ping timeout")
+            elif ticks_diff(now, self.last_tx) >= self.keepalive * 500:
+                self.ping()
+
+    def _lost(self, e):
+        self.log(False, e)
+        self._close()
+        self.delay = 0
+        self._backoff()
+        if self.pending():
+            self._save_queue()
+
+    # Messages not acknowledged in order, as (topic, msg, retain).
+    def _pending_msgs(self):
+        msgs = []
+        for pid in sorted(self.inflight, key=lambda pid: self.inflight[pid][2]):
+            pkt = self.inflight[pid][0]
+            i = 1
+            while pkt[i] & 0x80:
+                i += 1
+            n = pkt[i + 1] << 8 | pkt[i + 2]
+            topic = bytes(pkt[i + 3 : i + 3 + n])
+            msgs.append((topic, bytes(pkt[i + 5 + n :]), pkt[0] & 1))
+        return msgs + self.queue
+
+    # Each message: retain, topic and message lengths, topic, message.
+    def _save_queue(self):
+        if self.queue_file:
+            try:
+                with open(self.queue_file, "wb") as f:
+                    for topic, msg, retain in self._pending_msgs():
+                        f.write(struct.pack("!BHH", retain, len(topic), len(msg)))
+                        f.write(topic)
+                        f.write(msg)
+                self.queue_saved = True
+            except OSError as e:
+                self.log(False, e)
+
+    def _load_queue(self):
+        try:
+            with open(self.queue_file, "rb") as f:
+                data = f.read()
+        except OSError:
+            return
+        i = 0
+        while i + 5 <= len(data):
+            retain, topic_len, msg_len = struct.unpack_from("!BHH", data, i)
+            i += 5
+            topic = data[i : i + topic_len]
+            i += topic_len
+            self.queue.append((topic, data[i : i + msg_len], retain))
+            i += msg_len
+        self.queue_saved = True
+
+    def _remove_queue(self):
+        try:
+            os.remove(self.queue_file)
+        except OSError:
+            pass
+        self.queue_saved = False
+
+    def _backoff(self):
+        # Doubled after each failure, half of it being random
+        self.delay = min(max(self.delay * 2, self.min_delay_ms), self.max_delay_ms)
+        half = self.delay // 2
+        self.next_try = ticks_add(ticks_ms(), half + getrandbits(16) % (half + 1))
+
+    def _close(self):
+        self.connected = False
+        self.rx_start = 0
+        self.rx_end = 0
+        if self.sock:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+            self.sock = None
+
+    # Any received packet shows the link is alive.
+    def _fill(self, timeout):
+        if super()._fill(timeout):
+            self.ping_at = None
+            return True
+        return False
+
+    def _send_publish(self, msgs, retain, qos):
+        self.last_tx = ticks_ms()
+        return super()._send_publish(msgs, retain, qos)
+
+    def _send_inflight(self, pid, dup):
+        self.last_tx = ticks_ms()
+        super()._send_inflight(pid, dup)
+
+    def _send_queued(self):
+        if self.connected:
+            super()._send_queued()
@@ -18,6 +18,7 @@ class MQTTClient:
         keepalive=0,
         ssl=None,
         ssl_params={},
+        tx_size=256,
     ):
         if port == 0:
             port = 8883 if ssl else 1883
@@ -36,6 +37,8 @@ class MQTTClient:
         self.lw_msg = None
         self.lw_qos = 0
         self.lw_retain = False
+        self.tx_size = tx_size
+        self.tx_buf = None
 
     def _send_str(self, s):
         self.sock.write(struct.pack("!H", len(s)))
@@ -122,59 +125,116 @@ class MQTTClient:
         self.sock.write(b"\xc0\0")
 
     def publish(self, topic, msg, retain=False, qos=0):
-        pkt = bytearray(b"\x30\0\0\0")
-        pkt[0] |= qos << 1 | retain
-        sz = 2 + len(topic) + len(msg)
+        self.publish_many(((topic, msg),), retain, qos)
+
+    # Publishes a sequence of (topic, msg) with as few writes as possible,
+    # the packets being gathered in the send buffer. With qos 1, returns
+    # once the last one is acknowledged (brokers acknowledge in order).
+    def publish_many(self, msgs, retain=False, qos=0):
+        pid = self._send_publish(msgs, retain, qos)
+        if qos == 1:
+            self._wait_puback(pid)
+        elif qos == 2:
+            assert 0
+
+    def _wait_puback(self, pid):
+        while 1:
+            op = self.wait_msg()
+            if op == 0x40:
+                sz = self.sock.read(1)
+                assert sz == b"\x02"
+                rcv_pid = self.sock.read(2)
+                rcv_pid = rcv_pid[0] << 8 | rcv_pid[1]
+                if pid == rcv_pid:
+                    return
+
+    # Writes the fixed header, topic and packet id of a PUBLISH packet of
+    # msg_len bytes of message in buf at i, returns the index after them.
+    def _put_publish(self, buf, i, topic, msg_len, retain, qos, pid):
+        buf[i] = 0x30 | qos << 1 | retain
+        sz = 2 + len(topic) + msg_len
         if qos > 0:
             sz += 2
         assert sz < 2097152
-        i = 1
+        i += 1
         while sz > 0x7F:
-            pkt[i] = (sz & 0x7F) | 0x80
+            buf[i] = (sz & 0x7F) | 0x80
             sz >>= 7
             i += 1
-        pkt[i] = sz
-        # print(hex(len(pkt)), hexlify(pkt, ":"))
-        self.sock.write(pkt, i + 1)
-        self._send_str(topic)
+        buf[i] = sz
+        struct.pack_into("!H", buf, i + 1, len(topic))
+        i += 3
+        buf[i : i + len(topic)] = topic
+        i += len(topic)
         if qos > 0:
-            self.pid += 1
-            pid = self.pid
-            struct.pack_into("!H", pkt, 0, pid)
-            self.sock.write(pkt, 2)
-        self.sock.write(msg)
-        if qos == 1:
-            while 1:
-                op = self.wait_msg()
-                if op == 0x40:
-                    sz = self.sock.read(1)
-                    assert sz == b"\x02"
-                    rcv_pid = self.sock.read(2)
-                    rcv_pid = rcv_pid[0] << 8 | rcv_pid[1]
-                    if pid == rcv_pid:
-                        return
-        elif qos == 2:
-            assert 0
+            struct.pack_into("!H", buf, i, pid)
+            i += 2
+        return i
+
+    # Sends PUBLISH packets, one write for all of those fitting together in
+    # the send buffer (tx_size bytes). Returns the last packet id (None with
+    # qos 0).
+    def _send_publish(self, msgs, retain, qos):
+        if self.tx_buf is None:
+            self.tx_buf = bytearray(self.tx_size)
+        buf = self.tx_buf
+        n = 0
+        pid = None
+        for topic, msg in msgs:
+            if type(topic) is str:
+                topic = topic.encode()
+            if type(msg) is str:
+                msg = msg.encode()
+            if qos > 0:
+                pid = self._new_pid()
+            # Fixed header of 5 bytes at most, topic length and packet id
+            size = 9 + len(topic) + len(msg)
+            if n + size > len(buf) and n:
+                self.sock.write(buf, n)
+                n = 0
+            if size > len(buf):
+                # Message too large for the buffer, written after the rest
+                n = self._put_publish(buf, 0, topic, len(msg), retain, qos, pid)
+                self.sock.write(buf, n)
+                self.sock.write(msg)
+                n = 0
+            else:
+                n = self._put_publish(buf, n, topic, len(msg), retain, qos, pid)
+                buf[n : n + len(msg)] = msg
+                n += len(msg)
+        if n:
+            self.sock.write(buf, n)
+        return pid
 
     def subscribe(self, topic, qos=0):
         assert self.cb is not None, "Subscribe callback is not set"
-        pkt = bytearray(b"\x82\0\0\0")
-        self.pid += 1
-        struct.pack_into("!BH", pkt, 1, 2 + 2 + len(topic) + 1, self.pid)
-        # print(hex(len(pkt)), hexlify(pkt, ":"))
-        self.sock.write(pkt)
-        self._send_str(topic)
-        self.sock.write(qos.to_bytes(1, "little"))
+        pid = self._send_subscribe(topic, qos)
         while 1:
             op = self.wait_msg()
             if op == 0x90:
                 resp = self.sock.read(4)
                 # print(resp)
-                assert resp[1] == pkt[2] and resp[2] == pkt[3]
+                assert resp[1] << 8 | resp[2] == pid
                 if resp[3] == 0x80:
                     raise MQTTException(resp[3])
                 return
 
+    # Sends a SUBSCRIBE packet and returns its packet id.
+    def _send_subscribe(self, topic, qos):
+        pkt = bytearray(b"\x82\0\0\0")
+        pid = self._new_pid()
+        struct.pack_into("!BH", pkt, 1, 2 + 2 + len(topic) + 1, pid)
+        # print(hex(len(pkt)), hexlify(pkt, ":"))
+        self.sock.write(pkt)
+        self._send_str(topic)
+        self.sock.write(qos.to_bytes(1, "little"))
+        return pid
+
+    # Packet ids are 1 to 65535.
+    def _new_pid(self):
+        self.pid = self.pid % 0xFFFF + 1
+        return self.pid
+
     # Wait for a single incoming MQTT message and process it.
     # Subscribed messages are delivered to a callback previously
     # set by .set_callback() method. Other (internal) MQTT
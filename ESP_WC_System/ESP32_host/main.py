@@ -2,7 +2,7 @@ import json
 import network
 import time
 from machine import Pin
-from umqtt.simple import MQTTClient
+from wcmqtt.robust import MQTTClient
 import ubinascii
 import machine
 
@@ -35,9 +35,10 @@ def connect_wifi():
 
 def mqtt_callback(topic, msg):
     """Handle incoming MQTT messages"""
-    topic_str = topic.decode()
+    # topic and msg are memoryviews of the client receive buffer
+    topic_str = bytes(topic).decode()
     try:
-        msg_str = msg.decode()
+        msg_str = bytes(msg).decode()
         print(f"Received: {topic_str} = {msg_str}")
         
         # Cố gắng parse JSON message
@@ -75,12 +76,16 @@ def main():
     print(f"Connecting to MQTT broker at {PC_HOST}...")
     
     try:
+        # check_msg() pings the broker and reconnects it when needed
         client = MQTTClient(CLIENT_ID, PC_HOST, MQTT_PORT, keepalive=30)
         client.set_callback(mqtt_callback)
-        client.connect()
-        print("✓ Connected to MQTT broker!")
+        try:
+            client.connect(timeout=5)
+            print("✓ Connected to MQTT broker!")
+        except Exception as e:
+            print(f"MQTT broker not reachable ({e}), retrying in background")
         
-        # Subscribe thành công
+        # Subscribe thành công (replayed after each reconnection)
         client.subscribe(b"wc/esp32/command")
         
         # Gửi status message dùng JSON
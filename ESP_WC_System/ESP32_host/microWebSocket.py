@@ -5,10 +5,61 @@ Copyright © 2018 Jean-Christophe Bos & HC² (www.hc2.fr)
 
 from   hashlib     import sha1
 from   binascii    import b2a_base64
-from   struct      import pack
+from   struct      import pack, unpack
 from   _thread     import start_new_thread, allocate_lock
+from   select      import poll, POLLIN, POLLOUT
+from   time        import time
 import gc
 
+try :
+    from errno import EAGAIN
+except ImportError :
+    EAGAIN = 11
+
+try :
+    import zlib                         # CPython, context takeover supported
+    if not hasattr(zlib, 'compressobj') :
+        zlib = None
+except ImportError :
+    zlib = None
+
+try :
+    import deflate                      # MicroPython, one stream per message
+    from   io import BytesIO
+except ImportError :
+    deflate = None
+
+try :
+    import micropython
+
+    @micropython.viper
+    def _unmaskViper(buf, start:int, length:int, mask) :
+        # XOR of 32 bits words between the unaligned head and tail bytes,
+        # the bytearray data being word aligned in the MicroPython heap.
+        b   = ptr8(buf)
+        m   = ptr8(mask)
+        end = start + length
+        i   = start
+        while i < end and (i & 3) != 0 :
+            b[i] = b[i] ^ m[(i - start) & 3]
+            i   += 1
+        if end - i >= 4 :
+            k  = i - start
+            mw = m[k & 3] | (m[(k+1) & 3] << 8) | (m[(k+2) & 3] << 16) | (m[(k+3) & 3] << 24)
+            w  = ptr32(buf)
+            j  = i >> 2
+            n  = end >> 2
+            while j < n :
+                w[j] = w[j] ^ mw
+                j   += 1
+            i = n << 2
+        while i < end :
+            b[i] = b[i] ^ m[(i - start) & 3]
+            i   += 1
+
+except ImportError :
+    _unmaskViper = None
+
 class MicroWebSocket :
 
     # ============================================================================
@@ -27,6 +78,40 @@ class MicroWebSocket :
     _msgTypeText   = 1
     _msgTypeBin    = 2
 
+    _sendBufLen    = 256    # Frames up to this size are sent in one write
+
+    _deflateExt     = 'permessage-deflate'
+    _deflateTail    = b'\x00\x00\xff\xff'
+    _deflateMinSize = 64    # Smaller messages are sent uncompressed
+
+    _rxHdrLen       = 14    # Longest frame header, control payloads follow it
+    _rxStateHeader  = 0
+    _rxStateExtHdr  = 1
+    _rxStatePayload = 2
+
+    _sendTimeoutMs  = 5000  # Send wait of non-blocking (polled) sessions
+    _closeTryLater  = 1013  # Close status code when no message buffer is available
+    _idleTimeout    = 3600  # Seconds without data before closing a session
+
+    # ============================================================================
+    # ===( Polled sessions )======================================================
+    # ============================================================================
+
+    _pollSessions   = { }
+    _pollLock       = allocate_lock()
+    _poller         = None
+    _pollRunning    = False
+
+    # ============================================================================
+    # ===( Memory budget )========================================================
+    # ============================================================================
+
+    _sessionMemCost = 640   # RAM of a session without message buffer, about
+    _memLock        = allocate_lock()
+    _memUsed        = 0     # Sessions and message buffers, free ones included
+    _msgBufPool     = [ ]   # Free message buffers, reused by all the sessions
+    _msgBufPoolMax  = 2
+
     # ============================================================================
     # ===( Utils  )===============================================================
     # ============================================================================
@@ -43,6 +128,20 @@ class MicroWebSocket :
 
     # ----------------------------------------------------------------------------
 
+    @staticmethod
+    def _unmask(buf, start, length, mask) :
+        # Unmasks length bytes of buf from start, the mask beginning at start
+        if _unmaskViper :
+            _unmaskViper(buf, start, length, mask)
+        else :
+            end  = start + length
+            mask = mask * ((length >> 2) + 1)
+            x    = int.from_bytes(memoryview(buf)[start:end], 'big') \
+                 ^ int.from_bytes(mask[:length], 'big')
+            buf[start:end] = x.to_bytes(length, 'big')
+
+    # ----------------------------------------------------------------------------
+
     @staticmethod
     def _tryStartThread(func, args=()) :
         for x in range(10) :
@@ -67,39 +166,153 @@ class MicroWebSocket :
     # ===( Constructor )==========================================================
     # ============================================================================
 
-    def __init__(self, socket, httpClient, httpResponse, maxRecvLen, threaded, acceptCallback) :
+    def __init__( self, socket, httpClient, httpResponse, maxRecvLen, threaded, acceptCallback,
+                  polled=False, memoryBudget=0 ) :
         self._socket            = socket
         self._httpCli           = httpClient
         self._closed            = True
         self._lock              = allocate_lock()
+        self._mpy               = hasattr(socket, 'read')   # MicroPython
+        self._polled            = polled
+        self._pollKey           = socket if self._mpy else socket.fileno()
+        self._sendPoll          = None
+        self._sendBuf           = None
+        self._sendMv            = None
+        self._deflate           = None
+        self._msgDeflated       = False
+        self._lastRecv          = time()
+        self._maxRecvLen        = maxRecvLen
+        self._memBudget         = memoryBudget
+        self._msgBuf            = None
+        self._msgMv             = None
+        self._memCost           = 0
+        self._closeCode         = None
         self.RecvTextCallback   = None
         self.RecvBinaryCallback = None
         self.ClosedCallback     = None
 
-        if hasattr(socket, 'read'):   # MicroPython
-            self._socketfile = self._socket
-        else:   # CPython
-            self._socketfile = self._socket.makefile('rwb')
-
-        if self._handshake(httpResponse) :
-            self._ctrlBuf = MicroWebSocket._tryAllocByteArray(0x7D)
-            self._msgBuf  = MicroWebSocket._tryAllocByteArray(maxRecvLen)
-            if self._ctrlBuf and self._msgBuf :
+        if not MicroWebSocket._admitSession(self, memoryBudget) :
+            print("MicroWebSocket : Memory budget reached, new WebSocket connection refused.")
+            try :
+                httpResponse.WriteResponseError(503)
+            except :
+                pass
+        elif self._handshake(httpResponse) :
+            # The message buffer is only taken from the pool during messages
+            self._rxBuf   = MicroWebSocket._tryAllocByteArray(self._rxHdrLen + 0x7D)
+            self._sendBuf = MicroWebSocket._tryAllocByteArray(MicroWebSocket._sendBufLen)
+            if self._rxBuf and self._sendBuf :
+                self._rxMv    = memoryview(self._rxBuf)
+                self._sendMv  = memoryview(self._sendBuf)
                 self._msgType = None
                 self._msgLen  = 0
-                if threaded :
+                self._rxReset()
+                if polled :
+                    # Sessions share one thread polling all their sockets
+                    self._socket.settimeout(0)
+                    self._closed = False
+                    self._acceptCallback(acceptCallback)
+                    if self._closed or MicroWebSocket._addPolledSession(self) :
+                        return
+                    self._closed = True
+                elif threaded :
                     if MicroWebSocket._tryStartThread(self._wsProcess, (acceptCallback, )) :
                         return
                 else :
                     self._wsProcess(acceptCallback)
                     return
             print("MicroWebSocket : Out of memory on new WebSocket connection.")
+        MicroWebSocket._releaseSession(self)
+        self._httpCli._closeSocket()
+
+    # ============================================================================
+    # ===( Memory budget )========================================================
+    # ============================================================================
+
+    @staticmethod
+    def _admitSession(webSocket, budget) :
+        # Admits the session if its fixed cost and one message buffer fit in
+        # the budget and in the free heap, the cost only is reserved.
+        cost = MicroWebSocket._sessionMemCost
+        need = cost + webSocket._maxRecvLen
+        MicroWebSocket._memLock.acquire()
         try :
-            if self._socketfile is not self._socket:
-                self._socketfile.close()
-            self._socket.close()
-        except :
-            pass
+            if budget and not MicroWebSocket._reserveMem(need, budget) :
+                return False
+            try :
+                if gc.mem_free() < need :
+                    gc.collect()
+                    if gc.mem_free() < need :
+                        return False
+            except AttributeError :
+                pass
+            MicroWebSocket._memUsed += cost
+            webSocket._memCost       = cost
+            return True
+        finally :
+            MicroWebSocket._memLock.release()
+
+    # ----------------------------------------------------------------------------
+
+    @staticmethod
+    def _releaseSession(webSocket) :
+        MicroWebSocket._releaseMsgBuf(webSocket)
+        MicroWebSocket._memLock.acquire()
+        MicroWebSocket._memUsed -= webSocket._memCost
+        webSocket._memCost       = 0
+        MicroWebSocket._memLock.release()
+
+    # ----------------------------------------------------------------------------
+
+    @staticmethod
+    def _reserveMem(size, budget) :
+        # Called with _memLock, frees pooled buffers until size fits in budget
+        pool = MicroWebSocket._msgBufPool
+        while MicroWebSocket._memUsed + size > budget :
+            if not pool :
+                return False
+            MicroWebSocket._memUsed -= len(pool.pop(0))
+        return True
+
+    # ----------------------------------------------------------------------------
+
+    @staticmethod
+    def _acquireMsgBuf(webSocket, budget) :
+        size = webSocket._maxRecvLen
+        buf  = None
+        MicroWebSocket._memLock.acquire()
+        try :
+            pool = MicroWebSocket._msgBufPool
+            for i in range(len(pool)) :
+                if len(pool[i]) == size :
+                    buf = pool.pop(i)
+                    break
+            if not buf and (not budget or MicroWebSocket._reserveMem(size, budget)) :
+                buf = MicroWebSocket._tryAllocByteArray(size)
+                if buf :
+                    MicroWebSocket._memUsed += size
+        finally :
+            MicroWebSocket._memLock.release()
+        if buf :
+            webSocket._msgBuf = buf
+            webSocket._msgMv  = memoryview(buf)
+            return True
+        return False
+
+    # ----------------------------------------------------------------------------
+
+    @staticmethod
+    def _releaseMsgBuf(webSocket) :
+        buf = webSocket._msgBuf
+        if buf :
+            webSocket._msgBuf = None
+            webSocket._msgMv  = None
+            MicroWebSocket._memLock.acquire()
+            if len(MicroWebSocket._msgBufPool) < MicroWebSocket._msgBufPoolMax :
+                MicroWebSocket._msgBufPool.append(buf)
+            else :
+                MicroWebSocket._memUsed -= len(buf)
+            MicroWebSocket._memLock.release()
 
     # ============================================================================
     # ===( Functions )============================================================
@@ -112,7 +325,11 @@ class MicroWebSocket :
                 key += self._handshakeSign
                 r = sha1(key.encode()).digest()
                 r = b2a_base64(r).decode().strip()
-                httpResponse.WriteSwitchProto("websocket", { "Sec-WebSocket-Accept" : r })
+                headers = { "Sec-WebSocket-Accept" : r }
+                ext = self._negotiateDeflate()
+                if ext :
+                    headers["Sec-WebSocket-Extensions"] = ext
+                httpResponse.WriteSwitchProto("websocket", headers)
                 return True
         except :
             pass
@@ -120,16 +337,102 @@ class MicroWebSocket :
 
     # ----------------------------------------------------------------------------
 
-    def _wsProcess(self, acceptCallback) :
-        self._socket.settimeout(3600)
-        self._closed = False
+    def _negotiateDeflate(self) :
+        # Accepts the first permessage-deflate offer that can be served with
+        # mws.WebSocketDeflateWindowBits and returns the response extension,
+        # or None to exchange uncompressed messages only.
+        srv = self._httpCli._microWebSrv
+        if not srv.WebSocketDeflate or not (zlib or deflate) :
+            return None
+        offers = self._httpCli.GetRequestHeaders().get('sec-websocket-extensions', None)
+        if not offers :
+            return None
+        wbits    = min(max(srv.WebSocketDeflateWindowBits, 9), 15)
+        takeover = srv.WebSocketDeflateTakeover and zlib is not None
+        for offer in offers.split(',') :
+            params = [ p.strip() for p in offer.split(';') ]
+            if params[0] != self._deflateExt :
+                continue
+            srvBits   = wbits
+            cliBits   = None
+            srvReset  = not takeover
+            cliReset  = not takeover
+            valid     = True
+            for p in params[1:] :
+                p = p.split('=', 1)
+                name  = p[0].strip()
+                value = p[1].strip().strip('"') if len(p) > 1 else None
+                try :
+                    if name == 'server_no_context_takeover' :
+                        srvReset = True
+                    elif name == 'client_no_context_takeover' :
+                        cliReset = True
+                    elif name == 'server_max_window_bits' :
+                        srvBits = min(srvBits, int(value))
+                    elif name == 'client_max_window_bits' :
+                        cliBits = min(wbits, int(value)) if value else wbits
+                    else :
+                        valid = False
+                except :
+                    valid = False
+            # The client window is only limited when it offers it, a window
+            # of 8 bits cannot be produced by the compressors.
+            if not valid or srvBits < 9 or (cliBits is None and wbits < 15) :
+                continue
+            ext = '%s; server_max_window_bits=%s' % (self._deflateExt, srvBits)
+            if cliBits is not None :
+                ext += '; client_max_window_bits=%s' % cliBits
+            if srvReset :
+                ext += '; server_no_context_takeover'
+            if cliReset :
+                ext += '; client_no_context_takeover'
+            self._deflate = [ srvBits, cliBits or 15, srvReset, cliReset, None, None ]
+            return ext
+        return None
+
+    # ----------------------------------------------------------------------------
+
+    def _compress(self, data) :
+        srvBits, cliBits, srvReset, cliReset, comp, decomp = self._deflate
+        if zlib :
+            if comp is None or srvReset :
+                comp = zlib.compressobj(-1, zlib.DEFLATED, -srvBits)
+                self._deflate[4] = comp
+            data = comp.compress(data) + comp.flush(zlib.Z_SYNC_FLUSH)
+            return data[:-4] if data[-4:] == self._deflateTail else data
+        # One final DEFLATE block followed by an empty block header (RFC 7692)
+        out  = BytesIO()
+        comp = deflate.DeflateIO(out, deflate.RAW, srvBits)
+        comp.write(data)
+        comp.close()
+        return out.getvalue() + b'\x00'
+
+    # ----------------------------------------------------------------------------
+
+    def _decompress(self, data, maxLen) :
+        # Returns the inflated message, or None when larger than maxLen
+        srvBits, cliBits, srvReset, cliReset, comp, decomp = self._deflate
+        if zlib :
+            if decomp is None or cliReset :
+                decomp = zlib.decompressobj(-cliBits)
+                self._deflate[5] = decomp
+            data = decomp.decompress(bytes(data) + self._deflateTail, maxLen)
+            return None if decomp.unconsumed_tail else data
+        decomp = deflate.DeflateIO(BytesIO(bytes(data) + self._deflateTail), deflate.RAW, cliBits)
+        data   = decomp.read(maxLen + 1)
+        return None if len(data) > maxLen else data
+
+    # ----------------------------------------------------------------------------
+
+    def _acceptCallback(self, acceptCallback) :
         try :
             acceptCallback(self, self._httpCli)
         except Exception as ex :
             print("MicroWebSocket : Error on accept callback (%s)." % str(ex))
-        while not self._closed :
-            if not self._receiveFrame() :
-                self.Close()
+
+    # ----------------------------------------------------------------------------
+
+    def _closedCallback(self) :
         if self.ClosedCallback :
             try :
                 self.ClosedCallback(self)
@@ -138,127 +441,403 @@ class MicroWebSocket :
 
     # ----------------------------------------------------------------------------
 
-    def _receiveFrame(self) :
+    def _wsProcess(self, acceptCallback) :
+        self._socket.settimeout(self._idleTimeout)
+        self._closed = False
+        self._acceptCallback(acceptCallback)
+        while not self._closed :
+            if not self._receive() :
+                self.Close()
+        self._closedCallback()
+
+    # ----------------------------------------------------------------------------
+
+    @staticmethod
+    def _addPolledSession(webSocket) :
+        MicroWebSocket._pollLock.acquire()
         try :
-            b = self._socketfile.read(2)
-            if not b or len(b) != 2 :
-                return False
+            if not MicroWebSocket._poller :
+                MicroWebSocket._poller = poll()
+            MicroWebSocket._poller.register(webSocket._socket, POLLIN)
+            MicroWebSocket._pollSessions[webSocket._pollKey] = webSocket
+            start = not MicroWebSocket._pollRunning
+            MicroWebSocket._pollRunning = True
+        finally :
+            MicroWebSocket._pollLock.release()
+        if start and not MicroWebSocket._tryStartThread(MicroWebSocket._pollProcess) :
+            MicroWebSocket._pollRunning = False
+            MicroWebSocket._removePolledSession(webSocket)
+            return False
+        return True
 
-            fin    = b[0] & 0x80 > 0
-            opcode = b[0] & 0x0F
-            masked = b[1] & 0x80 > 0
-            length = b[1] & 0x7F
+    # ----------------------------------------------------------------------------
 
-            if opcode == self._opContFrame and not self._msgType :
-                return False
-            elif opcode == self._opTextFrame :
-                self._msgType = self._msgTypeText
-            elif opcode == self._opBinFrame :
-                self._msgType = self._msgTypeBin
-
-            if length == 0x7E :
-                b = self._socketfile.read(2)
-                if not b or len(b) != 2 :
-                    return False
-                length = (b[0] << 8) + b[1]
-            elif length == 0x7F :
-                return False
+    @staticmethod
+    def _removePolledSession(webSocket) :
+        MicroWebSocket._pollLock.acquire()
+        if MicroWebSocket._pollSessions.pop(webSocket._pollKey, None) is not None :
+            try :
+                MicroWebSocket._poller.unregister(webSocket._socket)
+            except :
+                pass
+        MicroWebSocket._pollLock.release()
 
-            mask = self._socketfile.read(4) if masked else None
-            if masked and (not mask or len(mask) != 4) :
-                return False
+    # ----------------------------------------------------------------------------
 
-            if opcode == self._opContFrame or \
-               opcode == self._opTextFrame or \
-               opcode == self._opBinFrame :
+    @staticmethod
+    def _pollProcess() :
+        # Thread shared by all the polled sessions, ended when none is left
+        lastCheck = time()
+        while True :
+            MicroWebSocket._pollLock.acquire()
+            if not MicroWebSocket._pollSessions :
+                MicroWebSocket._pollRunning = False
+                MicroWebSocket._pollLock.release()
+                return
+            MicroWebSocket._pollLock.release()
+            try :
+                # Short timeout, sockets registered meanwhile are polled next
+                events = MicroWebSocket._poller.poll(200)
+            except :
+                events = ()
+            for ev in events :
+                webSocket = MicroWebSocket._pollSessions.get(ev[0], None)
+                if webSocket and not webSocket._closed :
+                    if not webSocket._receive() :
+                        webSocket.Close()
+            now = time()
+            if now - lastCheck >= 10 :
+                lastCheck = now
+                for webSocket in list(MicroWebSocket._pollSessions.values()) :
+                    if now - webSocket._lastRecv > MicroWebSocket._idleTimeout :
+                        webSocket.Close()
 
-                if length > 0 :
-                    buf = memoryview(self._msgBuf)[self._msgLen:]
-                    if length > len(buf) :
-                        return False
-                    x = self._socketfile.readinto(buf[0:length])
-                    if x != length :
-                        return False
-                    if masked :
-                        for i in range(length) :
-                            idx = self._msgLen + i
-                            self._msgBuf[idx] ^= mask[i%4]
-                    self._msgLen += length
-                    if fin :
-                        b = bytes(memoryview(self._msgBuf)[:self._msgLen])
-                        if self._msgType == self._msgTypeText :
-                            if self.RecvTextCallback :
-                                try :
-                                    self.RecvTextCallback(self, b.decode())
-                                except Exception as ex :
-                                    print("MicroWebSocket : Error on recv text callback (%s)." % str(ex))
-                        else :
-                            if self.RecvBinaryCallback :
-                                try :
-                                    self.RecvBinaryCallback(self, b)
-                                except Exception as ex :
-                                    print("MicroWebSocket : Error on recv binary callback (%s)." % str(ex))
-                        self._msgType = None
-                        self._msgLen  = 0
-                else :
-                    return False
+    # ----------------------------------------------------------------------------
 
-            elif opcode == self._opPingFrame :
+    def _recvInto(self, mv) :
+        # Returns the number of bytes received, 0 when the connection is
+        # closed or None when nothing is available on a non-blocking socket.
+        try :
+            if self._mpy :
+                n = self._socket.readinto(mv)
+            else :
+                n = self._socket.recv_into(mv)
+        except OSError as ex :
+            if ex.args and ex.args[0] == EAGAIN :
+                return None
+            raise
+        if n :
+            self._lastRecv = time()
+        return n
 
-                if length > len(self._ctrlBuf) :
-                    return False
-                if length > 0 :
-                    x = self._socketfile.readinto(self._ctrlBuf[0:length])
-                    if x != length :
+    # ----------------------------------------------------------------------------
+
+    def _rxReset(self) :
+        # Waits for the 2 first bytes of the next frame header
+        self._rxState = self._rxStateHeader
+        self._rxDest  = self._rxMv
+        self._rxPos   = 0
+        self._rxNeed  = 2
+
+    # ----------------------------------------------------------------------------
+
+    def _receive(self) :
+        # Receives and processes the available bytes, frame after frame, the
+        # parsing state being kept between calls. Returns False when the
+        # connection must be closed. A blocking socket is read until then.
+        try :
+            while not self._closed :
+                if self._rxPos < self._rxNeed :
+                    n = self._recvInto(self._rxDest[self._rxPos:self._rxNeed])
+                    if n is None :
+                        return True
+                    if not n :
                         return False
-                    pingData = memoryview(self._ctrlBuf)[:length]
+                    self._rxPos += n
+                    if self._rxPos < self._rxNeed :
+                        continue
+                if self._rxState == self._rxStateHeader :
+                    ok = self._rxHeader()
+                elif self._rxState == self._rxStateExtHdr :
+                    ok = self._rxExtHeader()
                 else :
-                    pingData = None
-                self._sendFrame(self._opPongFrame, pingData)
+                    ok = self._rxPayload()
+                if not ok :
+                    return False
+        except :
+            return False
+        return True
 
-            elif opcode == self._opCloseFrame :
-                self.Close()
+    # ----------------------------------------------------------------------------
 
-        except :
+    def _rxHeader(self) :
+        b0     = self._rxBuf[0]
+        b1     = self._rxBuf[1]
+        rsv1   = b0 & 0x40 > 0
+        opcode = b0 & 0x0F
+        if b0 & 0x30 :
+            return False
+        if opcode == self._opContFrame :
+            if not self._msgType :
+                return False
+        elif opcode == self._opTextFrame or opcode == self._opBinFrame :
+            if self._msgType or (rsv1 and not self._deflate) :
+                return False
+            self._msgType     = self._msgTypeText if opcode == self._opTextFrame \
+                                else self._msgTypeBin
+            self._msgDeflated = rsv1
+        elif rsv1 or opcode < self._opCloseFrame or opcode > self._opPongFrame :
             return False
+        self._rxFin    = b0 & 0x80 > 0
+        self._rxOpcode = opcode
+        self._rxMasked = b1 & 0x80 > 0
+        self._rxLen    = b1 & 0x7F
+        ext = 2 if self._rxLen == 0x7E else (8 if self._rxLen == 0x7F else 0)
+        self._rxState  = self._rxStateExtHdr
+        self._rxNeed   = 2 + ext + (4 if self._rxMasked else 0)
+        return True
+
+    # ----------------------------------------------------------------------------
 
+    def _rxExtHeader(self) :
+        pos = 2
+        if self._rxLen == 0x7E :
+            self._rxLen = (self._rxBuf[2] << 8) | self._rxBuf[3]
+            pos = 4
+        elif self._rxLen == 0x7F :
+            self._rxLen = unpack('>Q', self._rxMv[2:10])[0]
+            pos = 10
+        self._rxMask = bytes(self._rxMv[pos:pos+4]) if self._rxMasked else None
+        length = self._rxLen
+        self._rxSmall = self._rxFin and self._msgLen == 0 and length <= 0x7D
+        if self._rxOpcode <= self._opBinFrame and not self._rxSmall :
+            if length > self._maxRecvLen - self._msgLen :
+                return False
+            if not self._msgBuf and not MicroWebSocket._acquireMsgBuf(self, self._memBudget) :
+                self._closeCode = self._closeTryLater
+                return False
+            self._rxDest = self._msgMv[self._msgLen:self._msgLen+length]
+        else :
+            # Control frames and small unfragmented messages need no message buffer
+            if length > 0x7D :
+                return False
+            self._rxDest = self._rxMv[self._rxHdrLen:self._rxHdrLen+length]
+        self._rxState = self._rxStatePayload
+        self._rxPos   = 0
+        self._rxNeed  = length
         return True
 
     # ----------------------------------------------------------------------------
 
-    def _sendFrame(self, opcode, data=None, fin=True) :
-        if not self._closed and opcode >= 0x00 and opcode <= 0x0F :
-            dataLen = 0 if not data else len(data)
-            if dataLen <= 0xFFFF :
-                b1 = (0x80 | opcode) if fin else opcode
-                b2 = 0x7E if dataLen >= 0x7E else dataLen
-                self._lock.acquire()
+    def _rxPayload(self) :
+        opcode = self._rxOpcode
+        length = self._rxLen
+        ret    = True
+        if opcode <= self._opBinFrame and self._rxSmall :
+            if self._rxMasked and length > 0 :
+                MicroWebSocket._unmask(self._rxBuf, self._rxHdrLen, length, self._rxMask)
+            ret = self._rxMessage(self._rxMv[self._rxHdrLen:self._rxHdrLen+length])
+        elif opcode <= self._opBinFrame :
+            if self._rxMasked and length > 0 :
+                MicroWebSocket._unmask(self._msgBuf, self._msgLen, length, self._rxMask)
+            self._msgLen += length
+            if self._rxFin :
+                ret = self._rxMessage(self._msgMv[:self._msgLen])
+        elif opcode == self._opPingFrame :
+            if self._rxMasked and length > 0 :
+                MicroWebSocket._unmask(self._rxBuf, self._rxHdrLen, length, self._rxMask)
+            pingData = self._rxMv[self._rxHdrLen:self._rxHdrLen+length] if length > 0 else None
+            self._sendFrame(self._opPongFrame, pingData)
+        elif opcode == self._opCloseFrame :
+            self.Close()
+        self._rxReset()
+        return ret
+
+    # ----------------------------------------------------------------------------
+
+    def _rxMessage(self, data) :
+        if self._msgDeflated :
+            b = self._decompress(data, self._maxRecvLen)
+        else :
+            b = bytes(data)
+        msgType       = self._msgType
+        self._msgType = None
+        self._msgLen  = 0
+        MicroWebSocket._releaseMsgBuf(self)
+        if b is None :
+            return False
+        if msgType == self._msgTypeText :
+            if self.RecvTextCallback :
                 try :
-                    if self._socketfile.write(pack('>BB', b1, b2)) == 2 :
-                        if dataLen > 0 :
-                            if dataLen >= 0x7E :
-                                self._socketfile.write(pack('>H', dataLen))
-                            ret = self._socketfile.write(data) == dataLen
-                        else :
-                            ret = True
-                        if self._socketfile is not self._socket :
-                            self._socketfile.flush()   # CPython needs flush to continue protocol
-                        self._lock.release()
-                        return ret
-                except :
-                    pass
-                self._lock.release()
+                    self.RecvTextCallback(self, b.decode())
+                except Exception as ex :
+                    print("MicroWebSocket : Error on recv text callback (%s)." % str(ex))
+        else :
+            if self.RecvBinaryCallback :
+                try :
+                    self.RecvBinaryCallback(self, b)
+                except Exception as ex :
+                    print("MicroWebSocket : Error on recv binary callback (%s)." % str(ex))
+        return True
+
+    # ----------------------------------------------------------------------------
+
+    def _sendFrame(self, opcode, data=None, fin=True, compress=False) :
+        # Small frames are assembled in the send buffer and sent in one
+        # write, the header of larger ones is sent with the data in one
+        # scatter write when possible.
+        if not self._closed and opcode >= 0x00 and opcode <= 0x0F :
+            self._lock.acquire()
+            try :
+                # Compressed in the lock to keep the order of the context
+                rsv = 0
+                if compress :
+                    data = self._compress(data)
+                    rsv  = 0x40
+                dataLen = 0 if not data else len(data)
+                buf     = self._sendBuf
+                hdrLen  = MicroWebSocket._putHeader(buf, opcode, dataLen, fin, rsv)
+                if hdrLen + dataLen <= len(buf) :
+                    if dataLen > 0 :
+                        buf[hdrLen:hdrLen+dataLen] = data
+                    ret = self._write(self._sendMv[:hdrLen+dataLen])
+                else :
+                    ret = self._writeScatter(self._sendMv[:hdrLen], data)
+            except :
+                ret = False
+            self._lock.release()
+            return ret
         return False
 
     # ----------------------------------------------------------------------------
 
+    @staticmethod
+    def _putHeader(buf, opcode, dataLen, fin, rsv=0) :
+        # Writes the header of a server frame in buf and returns its length
+        buf[0] = ((0x80 | opcode) if fin else opcode) | rsv
+        if dataLen < 0x7E :
+            buf[1] = dataLen
+            return 2
+        if dataLen <= 0xFFFF :
+            buf[1] = 0x7E
+            buf[2] = dataLen >> 8
+            buf[3] = dataLen & 0xFF
+            return 4
+        buf[1] = 0x7F
+        for i in range(8) :
+            buf[9-i] = (dataLen >> (i*8)) & 0xFF
+        return 10
+
+    # ----------------------------------------------------------------------------
+
+    @staticmethod
+    def _encodeFrame(opcode, data=None, fin=True) :
+        # Returns the complete frame (header and data) sent by a server
+        dataLen = 0 if not data else len(data)
+        hdr     = bytearray(10)
+        hdrLen  = MicroWebSocket._putHeader(hdr, opcode, dataLen, fin)
+        frame   = bytearray(hdrLen + dataLen)
+        frame[:hdrLen] = memoryview(hdr)[:hdrLen]
+        if dataLen > 0 :
+            frame[hdrLen:] = data
+        return frame
+
+    # ----------------------------------------------------------------------------
+
+    def _write(self, data) :
+        if not self._polled :
+            if self._mpy :
+                return self._socket.write(data) == len(data)
+            self._socket.sendall(data)
+            return True
+        # Non-blocking socket, waits for room up to _sendTimeoutMs each time
+        mv  = memoryview(data)
+        pos = 0
+        while pos < len(mv) :
+            try :
+                if self._mpy :
+                    n = self._socket.write(mv[pos:])
+                else :
+                    n = self._socket.send(mv[pos:])
+            except OSError as ex :
+                if not ex.args or ex.args[0] != EAGAIN :
+                    raise
+                n = None
+            if n :
+                pos += n
+            elif not self._isWritable(self._sendTimeoutMs) :
+                return False
+        return True
+
+    # ----------------------------------------------------------------------------
+
+    def _writeScatter(self, hdr, data) :
+        if hasattr(self._socket, 'sendmsg') :   # CPython
+            try :
+                sent = self._socket.sendmsg((hdr, data))
+            except OSError as ex :
+                if not ex.args or ex.args[0] != EAGAIN :
+                    raise
+                sent = 0
+            if sent < len(hdr) :
+                return self._write(hdr[sent:]) and self._write(data)
+            return self._write(memoryview(data)[sent-len(hdr):])
+        return self._write(hdr) and self._write(data)
+
+    # ----------------------------------------------------------------------------
+
+    def _sendEncodedFrame(self, frame, timeoutMs=None) :
+        # With timeoutMs, fails without sending anything when the socket
+        # cannot take more data within this time (client not reading).
+        if not self._closed :
+            self._lock.acquire()
+            try :
+                if timeoutMs is not None and not self._isWritable(timeoutMs) :
+                    ret = False
+                else :
+                    ret = self._write(frame)
+            except :
+                ret = False
+            self._lock.release()
+            return ret
+        return False
+
+    # ----------------------------------------------------------------------------
+
+    def _isWritable(self, timeoutMs) :
+        if not self._sendPoll :
+            self._sendPoll = poll()
+            self._sendPoll.register(self._socket, POLLOUT)
+        for ev in self._sendPoll.poll(timeoutMs) :
+            if ev[1] & POLLOUT :
+                return True
+        return False
+
+    # ----------------------------------------------------------------------------
+
+    def _abort(self) :
+        # Closes the connection from another thread than the receiving one,
+        # that is woken up by the shutdown to close it itself.
+        try :
+            self._socket.shutdown(2)
+        except :
+            self.Close()
+
+    # ----------------------------------------------------------------------------
+
+    def _sendMessage(self, opcode, data) :
+        compress = self._deflate is not None and len(data) >= self._deflateMinSize
+        return self._sendFrame(opcode, data, compress=compress)
+
+    # ----------------------------------------------------------------------------
+
     def SendText(self, msg) :
-        return self._sendFrame(self._opTextFrame, msg.encode())
+        return self._sendMessage(self._opTextFrame, msg.encode())
 
     # ----------------------------------------------------------------------------
 
     def SendBinary(self, data) :
-        return self._sendFrame(self._opBinFrame, data)
+        return self._sendMessage(self._opBinFrame, data)
 
     # ----------------------------------------------------------------------------
 
@@ -270,15 +849,108 @@ class MicroWebSocket :
     def Close(self) :
         if not self._closed :
             try :
-                self._sendFrame(self._opCloseFrame)
-                if self._socketfile is not self._socket:
-                    self._socketfile.close()
-                self._socket.close()
-                self._closed = True
+                code = pack('>H', self._closeCode) if self._closeCode else None
+                self._sendFrame(self._opCloseFrame, code)
             except :
                 pass
+            if self._polled :
+                MicroWebSocket._removePolledSession(self)
+            self._httpCli._closeSocket()
+            self._closed = True
+            MicroWebSocket._releaseSession(self)
+            if self._polled :
+                self._closedCallback()
 
     # ============================================================================
     # ============================================================================
     # ============================================================================
 
+class MicroWebSocketHub :
+
+    # ============================================================================
+    # ===( Constructor )==========================================================
+    # ============================================================================
+
+    def __init__(self, sendTimeoutMs=500) :
+        self._groups       = { }
+        self._lock         = allocate_lock()
+        self.SendTimeoutMs = sendTimeoutMs
+
+    # ============================================================================
+    # ===( Functions )============================================================
+    # ============================================================================
+
+    def Join(self, webSocket, topic) :
+        self._lock.acquire()
+        members = self._groups.get(topic, None)
+        if members is None :
+            self._groups[topic] = [ webSocket ]
+        elif webSocket not in members :
+            members.append(webSocket)
+        self._lock.release()
+
+    # ----------------------------------------------------------------------------
+
+    def Leave(self, webSocket, topic=None) :
+        # Leaves the group of topic, or all the groups when topic is None
+        self._lock.acquire()
+        topics = [ topic ] if topic is not None else list(self._groups)
+        for t in topics :
+            members = self._groups.get(t, None)
+            if members and webSocket in members :
+                members.remove(webSocket)
+                if not members :
+                    del self._groups[t]
+        self._lock.release()
+
+    # ----------------------------------------------------------------------------
+
+    def GetMembers(self, topic) :
+        self._lock.acquire()
+        members = list(self._groups.get(topic, ()))
+        self._lock.release()
+        return members
+
+    # ----------------------------------------------------------------------------
+
+    def GetTopics(self) :
+        self._lock.acquire()
+        topics = list(self._groups)
+        self._lock.release()
+        return topics
+
+    # ----------------------------------------------------------------------------
+
+    def BroadcastText(self, topic, msg) :
+        return self._broadcast(topic, MicroWebSocket._opTextFrame, msg.encode())
+
+    # ----------------------------------------------------------------------------
+
+    def BroadcastBinary(self, topic, data) :
+        return self._broadcast(topic, MicroWebSocket._opBinFrame, data)
+
+    # ============================================================================
+    # ===( Utils  )===============================================================
+    # ============================================================================
+
+    def _broadcast(self, topic, opcode, data) :
+        # The frame is encoded once and the same buffer is sent to each
+        # member. Members closed, failing to send or not able to take the
+        # frame within SendTimeoutMs (not reading) are closed and removed
+        # from all groups. Returns the number of members reached.
+        members = self.GetMembers(topic)
+        if not members :
+            return 0
+        frame = MicroWebSocket._encodeFrame(opcode, data)
+        count = 0
+        for webSocket in members :
+            if webSocket._sendEncodedFrame(frame, self.SendTimeoutMs) :
+                count += 1
+            else :
+                self.Leave(webSocket)
+                webSocket._abort()
+        return count
+
+    # ============================================================================
+    # ============================================================================
+    # ============================================================================
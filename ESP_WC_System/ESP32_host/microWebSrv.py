@@ -7,6 +7,7 @@ Copyright © 2018 Jean-Christophe Bos & HC² (www.hc2.fr)
 from    json        import loads, dumps
 from    os          import stat
 from    _thread     import start_new_thread
+from    time        import gmtime
 import  socket
 import  gc
 import  re
@@ -30,6 +31,15 @@ class MicroWebSrvRoute :
         self.routeRegex    = routeRegex   
 
 
+class MicroWebSrvRouteNode :
+    # Node of the prefix tree indexing variable routes by path segments
+    def __init__(self) :
+        self.children = { }     # literal segment -> MicroWebSrvRouteNode
+        self.argChild = None    # MicroWebSrvRouteNode for a <arg> segment
+        self.routeIdx = None    # index of the route ending on this node
+        self.route    = None
+
+
 class MicroWebSrv :
 
     # ============================================================================
@@ -80,12 +90,21 @@ class MicroWebSrv :
 
     _pyhtmlPagesExt = '.pyhtml'
 
+    _httpDays   = ( 'Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun' )
+
+    _httpMonths = ( 'Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
+                    'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec' )
+
     # ============================================================================
     # ===( Class globals  )=======================================================
     # ============================================================================
 
     _docoratedRouteHandlers = []
 
+    _reRouteArg = re.compile(r'\w*$')
+
+    _bufHasFind = hasattr(bytearray, 'find')
+
     # ============================================================================
     # ===( Utils  )===============================================================
     # ============================================================================
@@ -161,6 +180,25 @@ class MicroWebSrv :
     def _isPyHTMLFile(filename) :
         return filename.lower().endswith(MicroWebSrv._pyhtmlPagesExt)
 
+    # ----------------------------------------------------------------------------
+
+    @staticmethod
+    def _httpDate(secs) :
+        t = gmtime(secs)
+        return '%s, %02d %s %04d %02d:%02d:%02d GMT' % ( MicroWebSrv._httpDays[t[6]],
+                                                         t[2],
+                                                         MicroWebSrv._httpMonths[t[1]-1],
+                                                         t[0], t[3], t[4], t[5] )
+
+    # ----------------------------------------------------------------------------
+
+    @staticmethod
+    def _memFree() :
+        try :
+            return gc.mem_free()
+        except :
+            return None
+
     # ============================================================================
     # ===( Constructor )==========================================================
     # ============================================================================
@@ -178,10 +216,51 @@ class MicroWebSrv :
 
         self.MaxWebSocketRecvLen        = 1024
         self.WebSocketThreaded          = True
+        self.WebSocketPolled            = False
+        self.WebSocketMemoryBudget      = 0
+        self.WebSocketDeflate           = False
+        self.WebSocketDeflateWindowBits = 10
+        self.WebSocketDeflateTakeover   = True
         self.AcceptWebSocketCallback    = None
         self.LetCacheStaticContentLevel = 2
-
-        self._routeHandlers = []
+        self.StaticCacheMaxAge          = 0
+        self.StaticETagVersion          = None
+        self.StaticValidatorsCacheSize  = 16
+        self.StaticFileCacheSize        = 48 * 1024
+        self.StaticFileCacheMaxFileSize = 20 * 1024
+        self.StaticFileCacheMinMemFree  = 24 * 1024
+        self.StaticPathCacheSize        = 32
+        self.RequestBufferSize          = 1024
+        self.ResponseChunkSize          = 1024
+        self.ResponseHeadersBufferSize  = 1536
+        self.FileBufferMaxSize          = 8192
+        self.StreamPyHTMLPages          = False
+        self.ParsedRequestHeaders       = set( ( 'content-length',
+                                                 'content-type',
+                                                 'connection',
+                                                 'upgrade',
+                                                 'accept-encoding',
+                                                 'if-none-match',
+                                                 'if-modified-since',
+                                                 'sec-websocket-key',
+                                                 'sec-websocket-extensions',
+                                                 'range',
+                                                 'if-range' ) )
+
+        self._recvBuf          = None
+        self._sendBuf          = None
+        self._fileBuf          = None
+        self._parsedHdrsLens   = None
+        self._staticPaths      = { }
+        self._staticValidators = { }
+        self._staticFiles      = { }
+        self._staticFilesBytes = 0
+        self._staticFilesTick  = 0
+        self._staticFilesHits  = 0
+        self._staticFilesMiss  = 0
+        self._routeHandlers    = []
+        self._literalRoutes    = { }    # (method, path) -> route
+        self._argRoutesTrees   = { }    # method -> MicroWebSrvRouteNode
         routeHandlers += self._docoratedRouteHandlers
         for route, method, func in routeHandlers :
             routeParts = route.split('/')
@@ -194,11 +273,14 @@ class MicroWebSrv :
                     routeRegex += '/(\\w*)'
                 elif s :
                     routeRegex += '/' + s
+            literalPath = routeRegex
             routeRegex += '$'
             # -> '/users/(\w*)/addresses/(\w*)/test/(\w*)$'
             routeRegex = re.compile(routeRegex)
 
-            self._routeHandlers.append(MicroWebSrvRoute(route, method, func, routeArgNames, routeRegex))
+            rh = MicroWebSrvRoute(route, method, func, routeArgNames, routeRegex)
+            self._addRouteToIndex(len(self._routeHandlers), rh, routeParts, literalPath)
+            self._routeHandlers.append(rh)
 
     # ============================================================================
     # ===( Server Process )=======================================================
@@ -222,6 +304,11 @@ class MicroWebSrv :
 
     def Start(self, threaded=False) :
         if not self._started :
+            self._recvBuf = None
+            if self.ParsedRequestHeaders is not None :
+                self._parsedHdrsLens = set(len(name) for name in self.ParsedRequestHeaders)
+            else :
+                self._parsedHdrsLens = None
             self._server = socket.socket()
             self._server.setsockopt( socket.SOL_SOCKET,
                                      socket.SO_REUSEADDR,
@@ -252,40 +339,237 @@ class MicroWebSrv :
     # ----------------------------------------------------------------------------
 
     def GetMimeTypeFromFilename(self, filename) :
-        filename = filename.lower()
-        for ext in self._mimeTypes :
-            if filename.endswith(ext) :
-                return self._mimeTypes[ext]
+        idx = filename.rfind('.')
+        if idx >= 0 :
+            return self._mimeTypes.get(filename[idx:].lower(), None)
         return None
 
     # ----------------------------------------------------------------------------
     
+    def _addRouteToIndex(self, idx, rh, routeParts, literalPath) :
+        if not rh.routeArgNames :
+            key  = (rh.method, literalPath)
+            tree = self._argRoutesTrees.get(rh.method, None)
+            # Not indexed when an earlier route with arguments matches its
+            # path, this one being never reached
+            if key not in self._literalRoutes and \
+               ( tree is None or \
+                 MicroWebSrv._matchArgRoute(tree, literalPath.split('/'), 1, []) is None ) :
+                self._literalRoutes[key] = rh
+            return
+        node = self._argRoutesTrees.get(rh.method, None)
+        if node is None :
+            node = MicroWebSrvRouteNode()
+            self._argRoutesTrees[rh.method] = node
+        for s in routeParts :
+            if s.startswith('<') and s.endswith('>') :
+                if node.argChild is None :
+                    node.argChild = MicroWebSrvRouteNode()
+                node = node.argChild
+            elif s :
+                child = node.children.get(s, None)
+                if child is None :
+                    child = MicroWebSrvRouteNode()
+                    node.children[s] = child
+                node = child
+        if node.routeIdx is None :
+            node.routeIdx = idx
+            node.route    = rh
+
+    # ----------------------------------------------------------------------------
+
+    @staticmethod
+    def _matchArgRoute(node, segments, pos, args) :
+        # Returns (index, route, args values) of the first registered route
+        # matching segments[pos:] under node, or None.
+        if pos == len(segments) :
+            if node.route is not None :
+                return (node.routeIdx, node.route, list(args))
+            return None
+        found = None
+        child = node.children.get(segments[pos], None)
+        if child is not None :
+            found = MicroWebSrv._matchArgRoute(child, segments, pos+1, args)
+        if node.argChild is not None and \
+           MicroWebSrv._reRouteArg.match(segments[pos]) :
+            args.append(segments[pos])
+            r = MicroWebSrv._matchArgRoute(node.argChild, segments, pos+1, args)
+            args.pop()
+            if r is not None and (found is None or r[0] < found[0]) :
+                found = r
+        return found
+
+    # ----------------------------------------------------------------------------
+
     def GetRouteHandler(self, resUrl, method) :
         if self._routeHandlers :
             #resUrl = resUrl.upper()
             if resUrl.endswith('/') :
                 resUrl = resUrl[:-1]
-            method = method.upper()
-            for rh in self._routeHandlers :
-                if rh.method == method :
-                    m = rh.routeRegex.match(resUrl)
-                    if m :   # found matching route?
-                        if rh.routeArgNames :
-                            routeArgs = {}
-                            for i, name in enumerate(rh.routeArgNames) :
-                                value = m.group(i+1)
-                                try :
-                                    value = int(value)
-                                except :
-                                    pass
-                                routeArgs[name] = value
-                            return (rh.func, routeArgs)
-                        else :
-                            return (rh.func, None)
+            method  = method.upper()
+            literal = self._literalRoutes.get((method, resUrl), None)
+            if literal is not None :
+                return (literal.func, None)
+            tree = self._argRoutesTrees.get(method, None)
+            if tree is not None :
+                segments = resUrl.split('/')
+                if not segments[0] :
+                    found = MicroWebSrv._matchArgRoute(tree, segments, 1, [])
+                    if found is not None :
+                        rh        = found[1]
+                        routeArgs = {}
+                        for i, name in enumerate(rh.routeArgNames) :
+                            value = found[2][i]
+                            try :
+                                value = int(value)
+                            except :
+                                pass
+                            routeArgs[name] = value
+                        return (rh.func, routeArgs)
         return (None, None)
 
     # ----------------------------------------------------------------------------
 
+    def GetStaticFileValidators(self, filepath) :
+        try :
+            st = stat(filepath)
+        except :
+            return None
+        return self._getStaticFileValidators(filepath, st)
+
+    # ----------------------------------------------------------------------------
+
+    def _getStaticFileValidators(self, filepath, st) :
+        # Returns (ETag, Last-Modified) for filepath, rebuilt only when the
+        # size or the modification time of the file differ from the cached ones.
+        size  = st[6]
+        mtime = int(st[8])
+        entry = self._staticValidators.get(filepath, None)
+        if entry and entry[0] == size and entry[1] == mtime :
+            entry[3] = self._nextStaticTick()
+            return entry[2]
+        etag = '"%s%x-%x"' % ( (self.StaticETagVersion + '-') if self.StaticETagVersion else '',
+                               mtime,
+                               size )
+        lastModified = MicroWebSrv._httpDate(mtime) if mtime > 0 else None
+        if filepath not in self._staticValidators and \
+           len(self._staticValidators) >= self.StaticValidatorsCacheSize :
+            MicroWebSrv._evictLRU(self._staticValidators)
+        self._staticValidators[filepath] = [size, mtime, (etag, lastModified), self._nextStaticTick()]
+        return (etag, lastModified)
+
+    # ----------------------------------------------------------------------------
+
+    def GetStaticFileCacheStats(self) :
+        return { 'hits'   : self._staticFilesHits,
+                 'misses' : self._staticFilesMiss,
+                 'files'  : len(self._staticFiles),
+                 'bytes'  : self._staticFilesBytes }
+
+    # ----------------------------------------------------------------------------
+
+    def ClearStaticFileCache(self) :
+        self._staticFiles      = { }
+        self._staticFilesBytes = 0
+
+    # ----------------------------------------------------------------------------
+
+    def InvalidateStaticContent(self) :
+        # To call after files of webPath were written (upload, OTA update, ...)
+        self._staticPaths      = { }
+        self._staticValidators = { }
+        self.ClearStaticFileCache()
+
+    # ----------------------------------------------------------------------------
+
+    def _nextStaticTick(self) :
+        # Use counter of the static caches entries, the least recently used
+        # one is evicted (dict order is not the insertion one on MicroPython)
+        self._staticFilesTick += 1
+        return self._staticFilesTick
+
+    # ----------------------------------------------------------------------------
+
+    @staticmethod
+    def _evictLRU(cache) :
+        # Removes the entry of cache with the lowest tick, its last item
+        lru = None
+        for key in cache :
+            if lru is None or cache[key][-1] < cache[lru][-1] :
+                lru = key
+        if lru is not None :
+            del cache[lru]
+
+    # ----------------------------------------------------------------------------
+
+    def _evictStaticFile(self) :
+        lru = None
+        for filepath in self._staticFiles :
+            if lru is None or self._staticFiles[filepath][2] < self._staticFiles[lru][2] :
+                lru = filepath
+        if lru is not None :
+            self._staticFilesBytes -= len(self._staticFiles.pop(lru)[0])
+            return True
+        return False
+
+    # ----------------------------------------------------------------------------
+
+    def _trimStaticFileCache(self, needed=0) :
+        while self._staticFilesBytes + needed > self.StaticFileCacheSize :
+            if not self._evictStaticFile() :
+                break
+        memFree = MicroWebSrv._memFree()
+        while memFree is not None and memFree < self.StaticFileCacheMinMemFree + needed :
+            if not self._evictStaticFile() :
+                break
+            gc.collect()
+            memFree = MicroWebSrv._memFree()
+
+    # ----------------------------------------------------------------------------
+
+    def _getCachedStaticFile(self, filepath, validators) :
+        # Returns the preformatted response (headers + content) of filepath
+        # if it is cached and still matches the validators of the file.
+        self._trimStaticFileCache()
+        entry = self._staticFiles.get(filepath, None)
+        if entry :
+            if entry[1] == validators :
+                entry[2] = self._nextStaticTick()
+                self._staticFilesHits += 1
+                return entry[0]
+            self._staticFilesBytes -= len(self._staticFiles.pop(filepath)[0])
+        self._staticFilesMiss += 1
+        return None
+
+    # ----------------------------------------------------------------------------
+
+    def _canCacheStaticFile(self, size) :
+        # Makes room for size bytes in the cache, before allocating them
+        if size > self.StaticFileCacheSize :
+            return False
+        self._trimStaticFileCache(size)
+        memFree = MicroWebSrv._memFree()
+        return memFree is None or memFree >= self.StaticFileCacheMinMemFree + size
+
+    # ----------------------------------------------------------------------------
+
+    def _cacheStaticFile(self, filepath, validators, buf) :
+        self._staticFiles[filepath] = [memoryview(buf), validators, self._nextStaticTick()]
+        self._staticFilesBytes += len(buf)
+        return True
+
+    # ----------------------------------------------------------------------------
+
+    def _getStaticCacheHeaders(self, validators) :
+        headers = { 'Cache-Control' : 'max-age=%d' % self.StaticCacheMaxAge }
+        if validators :
+            headers['ETag'] = validators[0]
+            if validators[1] :
+                headers['Last-Modified'] = validators[1]
+        return headers
+
+    # ----------------------------------------------------------------------------
+
     def _physPathFromURLPath(self, urlPath) :
         if urlPath == '/' :
             for idxPage in self._indexPages :
@@ -298,6 +582,69 @@ class MicroWebSrv :
                 return physPath
         return None
 
+    # ----------------------------------------------------------------------------
+
+    def _resolveStaticPath(self, urlPath) :
+        # Returns (physPath, size, contentType, validators) of urlPath, or None
+        # if not found. Only physPath and contentType are kept : size and
+        # validators come from a stat done for each request, so a rewritten
+        # file is served with its new content and ETag.
+        cached = self._staticPaths.get(urlPath, None)
+        if cached is not None :
+            physPath, contentType = cached[0], cached[1]
+        else :
+            physPath = self._physPathFromURLPath(urlPath)
+            if not physPath :
+                return None
+            contentType = self.GetMimeTypeFromFilename(physPath)
+        try :
+            st = stat(physPath)
+        except :
+            if cached is not None :
+                del self._staticPaths[urlPath]
+            return None
+        if cached is not None :
+            cached[2] = self._nextStaticTick()
+        else :
+            if len(self._staticPaths) >= self.StaticPathCacheSize :
+                MicroWebSrv._evictLRU(self._staticPaths)
+            self._staticPaths[urlPath] = [physPath, contentType, self._nextStaticTick()]
+        return (physPath, st[6], contentType, self._getStaticFileValidators(physPath, st))
+
+    # ----------------------------------------------------------------------------
+
+    def _getRecvBuf(self) :
+        # Requests are parsed one after the other by the server process,
+        # so the same receive buffer is reused by every connection.
+        if self._recvBuf is None or len(self._recvBuf) != self.RequestBufferSize :
+            self._recvBuf = bytearray(self.RequestBufferSize)
+        return self._recvBuf
+
+    # ----------------------------------------------------------------------------
+
+    def _getSendBuf(self) :
+        if self._sendBuf is None or len(self._sendBuf) != self.ResponseHeadersBufferSize :
+            self._sendBuf = bytearray(self.ResponseHeadersBufferSize)
+        return self._sendBuf
+
+    # ----------------------------------------------------------------------------
+
+    def _getFileBuf(self, sock) :
+        # Files are sent through one buffer reused by every response, sized on
+        # the first use from the socket send buffer and the free memory.
+        if self._fileBuf is None :
+            size = self.FileBufferMaxSize
+            try :
+                size = min(size, sock.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF))
+            except :
+                pass
+            memFree = MicroWebSrv._memFree()
+            if memFree is not None :
+                size = min(size, memFree // 8)
+            size = max(512, size - size % 512)
+            self._fileBuf = memoryview(bytearray(size))
+        return self._fileBuf
+
     # ============================================================================
     # ===( Class Client  )========================================================
     # ============================================================================
@@ -320,8 +667,16 @@ class MicroWebSrv :
             self._headers       = { }
             self._contentType   = None
             self._contentLength = 0
+            self._recvBuf       = microWebSrv._getRecvBuf()
+            self._recvMv        = memoryview(self._recvBuf)
+            self._recvPos       = 0
+            self._recvEnd       = 0
+            self._recvFind      = None
+            self._contentUnread = 0
             
-            if hasattr(socket, 'readline'):   # MicroPython
+            # MicroPython socket, or a socket object setting IsStreamSocket to
+            # be used as one : read and written directly, without a socket file
+            if getattr(socket, 'IsStreamSocket', hasattr(socket, 'readline')) :
                 self._socketfile = self._socket
             else:   # CPython
                 self._socketfile = self._socket.makefile('rwb')
@@ -348,23 +703,22 @@ class MicroWebSrv :
                                     print('MicroWebSrv handler exception:\r\n  - In route %s %s\r\n  - %s' % (self._method, self._resPath, ex))
                                     raise ex
                             elif self._method.upper() == "GET" :
-                                filepath = self._microWebSrv._physPathFromURLPath(self._resPath)
-                                if filepath :
+                                static = self._microWebSrv._resolveStaticPath(self._resPath)
+                                if static :
+                                    filepath, size, contentType, validators = static
                                     if MicroWebSrv._isPyHTMLFile(filepath) :
                                         response.WriteResponsePyHTMLFile(filepath)
                                     else :
-                                        contentType = self._microWebSrv.GetMimeTypeFromFilename(filepath)
                                         if contentType :
                                             if self._microWebSrv.LetCacheStaticContentLevel > 0 :
+                                                headers = self._microWebSrv._getStaticCacheHeaders(validators)
                                                 if self._microWebSrv.LetCacheStaticContentLevel > 1 and \
-                                                   'if-modified-since' in self._headers :
-                                                    response.WriteResponseNotModified()
+                                                   self._isNotModified(headers) :
+                                                    response.WriteResponseNotModified(headers)
                                                 else:
-                                                    headers = { 'Last-Modified' : 'Fri, 1 Jan 2018 23:42:00 GMT', \
-                                                                'Cache-Control' : 'max-age=315360000' }
-                                                    response.WriteResponseFile(filepath, contentType, headers)
+                                                    response._writeStaticFile(filepath, contentType, headers, size, validators)
                                             else :
-                                                response.WriteResponseFile(filepath, contentType)
+                                                response._writeStaticFile(filepath, contentType, None, size, validators)
                                         else :
                                             response.WriteResponseForbidden()
                                 else :
@@ -378,7 +732,9 @@ class MicroWebSrv :
                                                 httpResponse   = response,
                                                 maxRecvLen     = self._microWebSrv.MaxWebSocketRecvLen,
                                                 threaded       = self._microWebSrv.WebSocketThreaded,
-                                                acceptCallback = self._microWebSrv.AcceptWebSocketCallback )
+                                                acceptCallback = self._microWebSrv.AcceptWebSocketCallback,
+                                                polled         = self._microWebSrv.WebSocketPolled,
+                                                memoryBudget   = self._microWebSrv.WebSocketMemoryBudget )
                                 return
                         else :
                             response.WriteResponseNotImplemented()
@@ -386,6 +742,17 @@ class MicroWebSrv :
                         response.WriteResponseBadRequest()
             except :
                 response.WriteResponseInternalServerError()
+            try :
+                response._flushHeaders()
+            except :
+                pass
+            self._closeSocket()
+
+        # ------------------------------------------------------------------------
+
+        def _closeSocket(self) :
+            # Also used by WebSockets, the CPython socket file keeps the
+            # connection open until it is closed (flushing pending data).
             try :
                 if self._socketfile is not self._socket:
                     self._socketfile.close()
@@ -395,9 +762,102 @@ class MicroWebSrv :
 
         # ------------------------------------------------------------------------
 
+        def _recvInto(self, mv) :
+            if self._socketfile is not self._socket :   # CPython
+                return self._socketfile.readinto1(mv)
+            data = self._socket.recv(len(mv))           # MicroPython
+            mv[:len(data)] = data
+            return len(data)
+
+        # ------------------------------------------------------------------------
+
+        def _fillRecvBuf(self, inContent=False) :
+            # Moves pending bytes to the head of the receive buffer and
+            # appends newly received ones after them. With inContent, never
+            # receives more than the request content left.
+            pending = self._recvEnd - self._recvPos
+            if self._recvPos > 0 :
+                if pending > 0 :
+                    self._recvMv[:pending] = self._recvMv[self._recvPos:self._recvEnd]
+                self._recvPos  = 0
+                self._recvEnd  = pending
+                self._recvFind = None
+            size = len(self._recvBuf)
+            if inContent :
+                size = min(size, self._recvEnd + self._contentUnread)
+            if self._recvEnd >= size :
+                return False
+            x = self._recvInto(self._recvMv[self._recvEnd:size])
+            if not x :
+                return False
+            self._recvEnd += x
+            self._recvFind = None
+            if inContent :
+                self._contentUnread -= x
+            return True
+
+        # ------------------------------------------------------------------------
+
+        def _findInRecvBuf(self, sep, start, end) :
+            if MicroWebSrv._bufHasFind :
+                return self._recvBuf.find(sep, start, end)
+            # No bytearray.find on MicroPython : searched at C level in a bytes
+            # copy of the received data, made once per buffer fill.
+            if self._recvFind is None or len(self._recvFind) < end :
+                self._recvFind = bytes(self._recvMv[:self._recvEnd])
+            return self._recvFind.find(sep, start, end)
+
+        # ------------------------------------------------------------------------
+
+        def _readLine(self, canSkip=False, inContent=False) :
+            # Returns (start, end) of the next line in the receive buffer,
+            # without its line ending, or None if it could not be received.
+            # With canSkip, a line longer than the buffer is dropped and
+            # (-1, -1) is returned.
+            scanned  = 0
+            skipping = False
+            while True :
+                i = self._findInRecvBuf(b'\n', self._recvPos + scanned, self._recvEnd)
+                if i >= 0 :
+                    start         = self._recvPos
+                    self._recvPos = i + 1
+                    if skipping :
+                        return (-1, -1)
+                    if i > start and self._recvBuf[i-1] == 13 :
+                        i -= 1
+                    return (start, i)
+                if self._recvPos == 0 and self._recvEnd >= len(self._recvBuf) :
+                    if not canSkip :
+                        return None
+                    skipping       = True
+                    self._recvEnd  = 0
+                    self._recvFind = None
+                scanned = self._recvEnd - self._recvPos
+                if not self._fillRecvBuf(inContent) :
+                    return None
+
+        # ------------------------------------------------------------------------
+
+        def _readPending(self, size) :
+            # Returns up to size bytes already received in the receive buffer
+            n = min(size, self._recvEnd - self._recvPos)
+            if n > 0 :
+                data = bytes(self._recvMv[self._recvPos:self._recvPos+n])
+                self._recvPos += n
+                return data
+            return b''
+
+        # ------------------------------------------------------------------------
+
         def _parseFirstLine(self, response) :
             try :
-                elements = self._socketfile.readline().decode().strip().split()
+                line = self._readLine()
+                if line is None :
+                    # Request line not fitting in the receive buffer
+                    if self._recvEnd >= len(self._recvBuf) :
+                        response.WriteResponseError(414)
+                    return False
+                elements = str(self._recvMv[line[0]:line[1]], 'UTF-8').split()
                 if len(elements) == 3 :
                     self._method  = elements[0].upper()
                     self._path    = elements[1]
@@ -421,17 +881,98 @@ class MicroWebSrv :
         # ------------------------------------------------------------------------
 
         def _parseHeader(self, response) :
+            buf      = self._recvBuf
+            keep     = self._microWebSrv.ParsedRequestHeaders
+            keepLens = self._microWebSrv._parsedHdrsLens
             while True :
-                elements = self._socketfile.readline().decode().strip().split(':', 1)
-                if len(elements) == 2 :
-                    self._headers[elements[0].strip().lower()] = elements[1].strip()
-                elif len(elements) == 1 and len(elements[0]) == 0 :
+                line = self._readLine(canSkip=True)
+                if line is None :
+                    return False
+                start, end = line
+                if start < 0 :
+                    continue
+                while end > start and (buf[end-1] == 32 or buf[end-1] == 9) :
+                    end -= 1
+                if start == end :
                     if self._method == 'POST' or self._method == 'PUT' :
                         self._contentType   = self._headers.get("content-type", None)
                         self._contentLength = int(self._headers.get("content-length", 0))
+                    pending = self._recvEnd - self._recvPos
+                    if pending > self._contentLength :
+                        self._recvEnd = self._recvPos + self._contentLength
+                        pending       = self._contentLength
+                    self._contentUnread = self._contentLength - pending
                     return True
-                else :
+                sep = self._findInRecvBuf(b':', start, end)
+                if sep < 0 :
                     return False
+                nameEnd = sep
+                while nameEnd > start and (buf[start] == 32 or buf[start] == 9) :
+                    start += 1
+                while nameEnd > start and (buf[nameEnd-1] == 32 or buf[nameEnd-1] == 9) :
+                    nameEnd -= 1
+                # Only headers used by the server (or asked by the application) are decoded
+                if keepLens is not None and (nameEnd - start) not in keepLens :
+                    continue
+                name = str(self._recvMv[start:nameEnd], 'ISO-8859-1').lower()
+                if keep is not None and name not in keep :
+                    continue
+                sep += 1
+                while sep < end and (buf[sep] == 32 or buf[sep] == 9) :
+                    sep += 1
+                self._headers[name] = str(self._recvMv[sep:end], 'UTF-8')
+
+        # ------------------------------------------------------------------------
+
+        def _getRequestRange(self, size, headers) :
+            # Returns (first, last) byte positions of a single bytes range asked
+            # for a content of size bytes, None to send the whole content or
+            # False if the range cannot be satisfied.
+            rng = self._headers.get('range', None)
+            if not rng or not rng.startswith('bytes=') or ',' in rng :
+                return None
+            ifRange = self._headers.get('if-range', None)
+            if ifRange is not None :
+                if not isinstance(headers, dict) or \
+                   ( ifRange != headers.get('ETag', None) and \
+                     ifRange != headers.get('Last-Modified', None) ) :
+                    return None
+            try :
+                first, last = rng[6:].split('-', 1)
+                first = first.strip()
+                last  = last.strip()
+                if first :
+                    first = int(first)
+                    last  = int(last) if last else size - 1
+                else :
+                    last  = int(last)
+                    if last <= 0 :
+                        return False
+                    first = max(0, size - last)
+                    last  = size - 1
+            except :
+                return None
+            if first >= size :
+                return False
+            if first > last :
+                return None
+            return (first, min(last, size - 1))
+
+        # ------------------------------------------------------------------------
+
+        def _isNotModified(self, cacheHeaders) :
+            ifNoneMatch = self._headers.get('if-none-match', None)
+            if ifNoneMatch is not None :
+                etag = cacheHeaders.get('ETag', None)
+                if etag :
+                    for tag in ifNoneMatch.split(',') :
+                        tag = tag.strip()
+                        if tag == '*' or tag == etag or tag == 'W/' + etag :
+                            return True
+                return False
+            ifModifiedSince = self._headers.get('if-modified-since', None)
+            return ifModifiedSince is not None and \
+                   ifModifiedSince == cacheHeaders.get('Last-Modified', None)
 
         # ------------------------------------------------------------------------
 
@@ -505,29 +1046,170 @@ class MicroWebSrv :
         def ReadRequestContent(self, size=None) :
             if size is None :
                 size = self._contentLength
+            # Never reads past the request content, not sent by the client
+            size = min(size, self._recvEnd - self._recvPos + self._contentUnread)
             if size > 0 :
                 try :
-                    return self._socketfile.read(size)
+                    data = self._readPending(size)
+                    if len(data) < size :
+                        rest = self._socketfile.read(size - len(data))
+                        self._contentUnread = max(0, self._contentUnread - len(rest))
+                        data += rest
+                    return data
                 except :
                     pass
             return b''
 
         # ------------------------------------------------------------------------
 
+        def ReadRequestContentChunks(self) :
+            # Yields the request content as memoryviews of the receive buffer,
+            # each one only valid until the next one is requested.
+            while True :
+                if self._recvEnd > self._recvPos :
+                    chunk         = self._recvMv[self._recvPos:self._recvEnd]
+                    self._recvPos = self._recvEnd
+                    yield chunk
+                if not self._fillRecvBuf(inContent=True) :
+                    return
+
+        # ------------------------------------------------------------------------
+
+        def ReadRequestPostedFormDataIter(self) :
+            # Yields (name, value) of an urlencoded content, field by field
+            field = None
+            while True :
+                i    = self._findInRecvBuf(b'&', self._recvPos, self._recvEnd)
+                last = False
+                if i < 0 :
+                    if self._recvPos == 0 and self._recvEnd >= len(self._recvBuf) :
+                        if field is None :
+                            field = bytearray()
+                        field.extend(self._recvMv[:self._recvEnd])
+                        self._recvPos = self._recvEnd
+                    if self._fillRecvBuf(inContent=True) :
+                        continue
+                    i    = self._recvEnd
+                    last = True
+                data          = self._recvMv[self._recvPos:i]
+                self._recvPos = i if last else i + 1
+                if field is not None :
+                    field.extend(data)
+                    data  = field
+                    field = None
+                if len(data) > 0 :
+                    param = str(data, 'UTF-8').split('=', 1)
+                    value = MicroWebSrv._unquote_plus(param[1]) if len(param) > 1 else ''
+                    yield (MicroWebSrv._unquote_plus(param[0]), value)
+                if last :
+                    return
+
+        # ------------------------------------------------------------------------
+
         def ReadRequestPostedFormData(self) :
-            res  = { }
-            data = self.ReadRequestContent()
-            if data :
-                elements = data.decode().split('&')
-                for s in elements :
-                    param = s.split('=', 1)
-                    if len(param) > 0 :
-                        value = MicroWebSrv._unquote_plus(param[1]) if len(param) > 1 else ''
-                        res[MicroWebSrv._unquote_plus(param[0])] = value
+            res = { }
+            try :
+                for name, value in self.ReadRequestPostedFormDataIter() :
+                    res[name] = value
+            except :
+                pass
             return res
 
         # ------------------------------------------------------------------------
 
+        def ReadRequestMultipartFormData(self, saveFileFunc=None) :
+            # Parses a multipart/form-data content while receiving it. File parts
+            # are written in the path returned by saveFileFunc(name, filename)
+            # (or skipped if it returns None) so that only the receive buffer is
+            # used whatever the size of the files.
+            # Returns (formData, files) where files[name] = (filename, path, size).
+            formData = { }
+            files    = { }
+            boundary = None
+            for param in (self._contentType or '').split(';') :
+                param = param.strip()
+                if param.lower().startswith('boundary=') :
+                    boundary = param[9:].strip('"')
+            if not boundary :
+                return None
+            delim = b'\r\n--' + boundary.encode()
+            if len(delim) + 4 > len(self._recvBuf) :
+                return None
+            # Skips the preamble up to the first boundary line
+            while True :
+                line = self._readLine(canSkip=True, inContent=True)
+                if line is None :
+                    return None
+                if bytes(self._recvMv[line[0]:line[1]]) == delim[2:] :
+                    break
+            while True :
+                name     = None
+                filename = None
+                while True :
+                    line = self._readLine(canSkip=True, inContent=True)
+                    if line is None :
+                        return None
+                    start, end = line
+                    if start == end :
+                        break
+                    if start >= 0 :
+                        header = str(self._recvMv[start:end], 'UTF-8')
+                        if header.lower().startswith('content-disposition:') :
+                            for param in header.split(';')[1:] :
+                                param = param.strip().split('=', 1)
+                                if len(param) == 2 :
+                                    if param[0].lower() == 'name' :
+                                        name = param[1].strip('"')
+                                    elif param[0].lower() == 'filename' :
+                                        filename = param[1].strip('"')
+                file  = None
+                path  = None
+                value = None
+                size  = 0
+                if filename is not None :
+                    if saveFileFunc :
+                        path = saveFileFunc(name, filename)
+                    if path :
+                        file = open(path, 'wb')
+                else :
+                    value = bytearray()
+                try :
+                    while True :
+                        i = self._findInRecvBuf(delim, self._recvPos, self._recvEnd)
+                        end = i if i >= 0 else self._recvEnd - len(delim) + 1
+                        if end > self._recvPos :
+                            data = self._recvMv[self._recvPos:end]
+                            if file :
+                                file.write(data)
+                            elif value is not None :
+                                value.extend(data)
+                            size         += len(data)
+                            self._recvPos = end
+                        if i >= 0 :
+                            self._recvPos += len(delim)
+                            break
+                        if not self._fillRecvBuf(inContent=True) :
+                            return None
+                finally :
+                    if file :
+                        file.close()
+                if path :
+                    files[name] = (filename, path, size)
+                    if path.startswith(self._microWebSrv._webPath) :
+                        self._microWebSrv.InvalidateStaticContent()
+                elif value is not None and name is not None :
+                    formData[name] = str(value, 'UTF-8')
+                while self._recvEnd - self._recvPos < 2 :
+                    if not self._fillRecvBuf(inContent=True) :
+                        return None
+                if self._recvBuf[self._recvPos] == 45 and self._recvBuf[self._recvPos+1] == 45 :
+                    return (formData, files)
+                line = self._readLine(canSkip=True, inContent=True)
+                if line is None :
+                    return None
+
+        # ------------------------------------------------------------------------
+
         def ReadRequestContentAsJSON(self) :
             data = self.ReadRequestContent()
             if data :
@@ -547,6 +1229,20 @@ class MicroWebSrv :
 
         def __init__(self, client) :
             self._client = client
+            self._hdrBuf = client._microWebSrv._getSendBuf()
+            self._hdrMv  = memoryview(self._hdrBuf)
+            self._hdrLen = 0
+            self._hdrSent = 0
+
+        # ------------------------------------------------------------------------
+
+        def _sendAll(self, data) :
+            while data :
+                n = self._client._socketfile.write(data)
+                if n is None :
+                    return False
+                data = data[n:]
+            return True
 
         # ------------------------------------------------------------------------
 
@@ -555,24 +1251,52 @@ class MicroWebSrv :
                 if type(data) == str :
                     data = data.encode(strEncoding)
                 data = memoryview(data)
-                while data :
-                    n = self._client._socketfile.write(data)
-                    if n is None :
-                        return False
+                if self._hdrLen > 0 :
+                    # Pending headers are sent with the beginning of data
+                    n = min(len(data), len(self._hdrBuf) - self._hdrLen)
+                    self._hdrMv[self._hdrLen:self._hdrLen+n] = data[:n]
+                    self._hdrLen += n
                     data = data[n:]
-                return True
+                    if not self._flushHeaders() :
+                        return False
+                return self._sendAll(data)
             return False
 
         # ------------------------------------------------------------------------
 
+        def _flushHeaders(self) :
+            if self._hdrLen > 0 :
+                n              = self._hdrLen
+                self._hdrLen   = 0
+                self._hdrSent += n
+                return self._sendAll(self._hdrMv[:n])
+            return True
+
+        # ------------------------------------------------------------------------
+
+        def _bufferHeader(self, s) :
+            # Headers are gathered in the send buffer until content is written
+            # (or _flushHeaders is called) to send the whole in one write.
+            s = s.encode('ISO-8859-1')
+            if self._hdrLen + len(s) > len(self._hdrBuf) :
+                if not self._flushHeaders() :
+                    return False
+                if len(s) > len(self._hdrBuf) :
+                    return self._sendAll(memoryview(s))
+            self._hdrMv[self._hdrLen:self._hdrLen+len(s)] = s
+            self._hdrLen += len(s)
+            return True
+
+        # ------------------------------------------------------------------------
+
         def _writeFirstLine(self, code) :
             reason = self._responseCodes.get(code, ('Unknown reason', ))[0]
-            return self._write("HTTP/1.1 %s %s\r\n" % (code, reason))
+            return self._bufferHeader("HTTP/1.1 %s %s\r\n" % (code, reason))
 
         # ------------------------------------------------------------------------
 
         def _writeHeader(self, name, value) :
-            return self._write("%s: %s\r\n" % (name, value))
+            return self._bufferHeader("%s: %s\r\n" % (name, value))
 
         # ------------------------------------------------------------------------
 
@@ -592,7 +1316,7 @@ class MicroWebSrv :
         # ------------------------------------------------------------------------
 
         def _writeEndHeader(self) :
-            return self._write("\r\n")
+            return self._bufferHeader("\r\n")
 
         # ------------------------------------------------------------------------
 
@@ -601,9 +1325,10 @@ class MicroWebSrv :
             if isinstance(headers, dict) :
                 for header in headers :
                     self._writeHeader(header, headers[header])
-            if contentLength > 0 :
+            if contentLength is None or contentLength > 0 :
                 self._writeContentTypeHeader(contentType, contentCharset)
-                self._writeHeader("Content-Length", contentLength)
+                if contentLength is not None :
+                    self._writeHeader("Content-Length", contentLength)
             self._writeServerHeader()
             self._writeHeader("Connection", "close")
             self._writeEndHeader()
@@ -619,6 +1344,7 @@ class MicroWebSrv :
                     self._writeHeader(header, headers[header])
             self._writeServerHeader()
             self._writeEndHeader()
+            self._flushHeaders()
             if self._client._socketfile is not self._client._socket :
                 self._client._socketfile.flush()   # CPython needs flush to continue protocol
 
@@ -635,18 +1361,83 @@ class MicroWebSrv :
                 self._writeBeforeContent(code, headers, contentType, contentCharset, contentLength)
                 if content :
                     return self._write(content)
-                return True
+                return self._flushHeaders()
             except :
                 return False
 
         # ------------------------------------------------------------------------
 
+        def WriteResponseStream(self, code, headers, contentType, contentCharset, generator) :
+            # Sends the str/bytes fragments yielded by generator without knowing
+            # the content length, using chunked transfer encoding (HTTP/1.1).
+            # Small fragments are gathered so that only one chunk is buffered.
+            chunked = (self._client._httpVer != 'HTTP/1.0')
+            if chunked :
+                headers = dict(headers) if isinstance(headers, dict) else { }
+                headers['Transfer-Encoding'] = 'chunked'
+            try :
+                self._writeBeforeContent(code, headers, contentType, contentCharset, None)
+                size = self._client._microWebSrv.ResponseChunkSize
+                # Chunk buffer : 10 bytes for the hexadecimal size line, data, CRLF
+                buf  = bytearray(10 + size + 2)
+                mv   = memoryview(buf)
+                n    = 0
+                for data in generator :
+                    if not data :
+                        continue
+                    if type(data) == str :
+                        data = data.encode(contentCharset or 'UTF-8')
+                    if n + len(data) > size :
+                        if n > 0 and not self._writeChunk(mv, n, chunked) :
+                            return False
+                        n = 0
+                        if len(data) > size :
+                            if not self._writeChunk(data, None, chunked) :
+                                return False
+                            continue
+                    mv[10+n:10+n+len(data)] = data
+                    n += len(data)
+                if n > 0 and not self._writeChunk(mv, n, chunked) :
+                    return False
+                if chunked :
+                    return self._write("0\r\n\r\n")
+                return self._flushHeaders()
+            except Exception as ex :
+                print('MicroWebSrv stream exception:\r\n  - In route %s %s\r\n  - %s' % (self._client._method, self._client._resPath, ex))
+                return False
+
+        # ------------------------------------------------------------------------
+
+        def _writeChunk(self, data, n, chunked) :
+            # data is either the chunk buffer of WriteResponseStream holding n
+            # bytes, or a fragment (n is None) sent as a chunk of its own.
+            if n is None :
+                if not chunked :
+                    return self._write(data)
+                return self._write("%x\r\n" % len(data)) and \
+                       self._write(data) and \
+                       self._write("\r\n")
+            if not chunked :
+                return self._write(data[10:10+n])
+            sizeLine = ("%x\r\n" % n).encode()
+            start    = 10 - len(sizeLine)
+            data[start:10]     = sizeLine
+            data[10+n:10+n+2]  = b"\r\n"
+            return self._write(data[start:10+n+2])
+
+        # ------------------------------------------------------------------------
+
         def WriteResponsePyHTMLFile(self, filepath, headers=None, vars=None) :
             if 'MicroWebTemplate' in globals() :
-                with open(filepath, 'r') as file :
-                    code = file.read()
-                mWebTmpl = MicroWebTemplate(code, escapeStrFunc=MicroWebSrv.HTMLEscape, filepath=filepath)
                 try :
+                    mWebTmpl = MicroWebTemplate.FromFile(filepath, escapeStrFunc=MicroWebSrv.HTMLEscape)
+                    if self._client._microWebSrv.StreamPyHTMLPages :
+                        fragments = mWebTmpl.ExecuteIter(None, vars)
+                        return self.WriteResponseStream( 200,
+                                                         headers,
+                                                         "text/html",
+                                                         "UTF-8",
+                                                         self._pyHTMLFragments(fragments) )
                     tmplResult = mWebTmpl.Execute(None, vars)
                     return self.WriteResponse(200, headers, "text/html", "UTF-8", tmplResult)
                 except Exception as ex :
@@ -662,22 +1453,41 @@ class MicroWebSrv :
 
         # ------------------------------------------------------------------------
 
+        def _pyHTMLFragments(self, fragments) :
+            # The status line is already sent when a streamed page fails to
+            # render, so the error message ends the page instead.
+            try :
+                for s in fragments :
+                    yield s
+            except Exception as ex :
+                yield self._execErrCtnTmpl % {
+                    'module'  : 'PyHTML',
+                    'message' : str(ex)
+                }
+
+        # ------------------------------------------------------------------------
+
         def WriteResponseFile(self, filepath, contentType=None, headers=None) :
             try :
                 size = stat(filepath)[6]
                 if size > 0 :
+                    headers = dict(headers) if isinstance(headers, dict) else { }
+                    headers['Accept-Ranges'] = 'bytes'
+                    rng = self._client._getRequestRange(size, headers)
+                    if rng is False :
+                        return self.WriteResponse( 416,
+                                                   { 'Content-Range' : 'bytes */%s' % size },
+                                                   None, None, None )
                     with open(filepath, 'rb') as file :
-                        self._writeBeforeContent(200, headers, contentType, None, size)
+                        code = 200
+                        if rng :
+                            file.seek(rng[0])
+                            headers['Content-Range'] = 'bytes %s-%s/%s' % (rng[0], rng[1], size)
+                            code = 206
+                            size = rng[1] - rng[0] + 1
+                        self._writeBeforeContent(code, headers, contentType, None, size)
                         try :
-                            buf = bytearray(1024)
-                            while size > 0 :
-                                x = file.readinto(buf)
-                                if x < len(buf) :
-                                    buf = memoryview(buf)[:x]
-                                if not self._write(buf) :
-                                    return False
-                                size -= x
-                            return True
+                            return self._writeFileContent(file, size)
                         except :
                             self.WriteResponseInternalServerError()
                             return False
@@ -688,6 +1498,74 @@ class MicroWebSrv :
 
         # ------------------------------------------------------------------------
 
+        def _writeFileContent(self, file, size) :
+            sock = self._client._socket
+            if self._client._socketfile is not sock and hasattr(sock, 'sendfile') :
+                # CPython : headers are flushed then the kernel sends the file
+                if not self._flushHeaders() :
+                    return False
+                self._client._socketfile.flush()
+                return sock.sendfile(file, file.tell(), size) == size
+            buf = self._client._microWebSrv._getFileBuf(sock)
+            while size > 0 :
+                x = file.readinto(buf[:size] if size < len(buf) else buf)
+                if not x :
+                    return False
+                if not self._write(buf[:x] if x < len(buf) else buf) :
+                    return False
+                size -= x
+            return True
+
+        # ------------------------------------------------------------------------
+
+        def _writeStaticFile(self, filepath, contentType=None, headers=None, size=None, validators=None) :
+            srv = self._client._microWebSrv
+            if validators is None :
+                validators = srv.GetStaticFileValidators(filepath)
+            if validators and srv.StaticFileCacheSize > 0 and \
+               'range' not in self._client._headers :
+                buf = srv._getCachedStaticFile(filepath, validators)
+                if buf is not None :
+                    return self._write(buf)
+                try :
+                    if size is None :
+                        size = stat(filepath)[6]
+                    if size > 0 and size <= srv.StaticFileCacheMaxFileSize and \
+                       self._hdrLen == 0 and self._hdrSent == 0 :
+                        with open(filepath, 'rb') as file :
+                            headers = dict(headers) if isinstance(headers, dict) else { }
+                            headers['Accept-Ranges'] = 'bytes'
+                            # Headers written as for any response, kept with the
+                            # content when they all stayed in the send buffer
+                            self._writeBeforeContent(200, headers, contentType, None, size)
+                            hdrLen = self._hdrLen
+                            if self._hdrSent == 0 and srv._canCacheStaticFile(hdrLen + size) :
+                                buf = bytearray(hdrLen + size)
+                                mv  = memoryview(buf)
+                                mv[:hdrLen] = self._hdrMv[:hdrLen]
+                                pos = hdrLen
+                                while pos < len(buf) :
+                                    x = file.readinto(mv[pos:])
+                                    if not x :
+                                        break
+                                    pos += x
+                                if pos == len(buf) :
+                                    srv._cacheStaticFile(filepath, validators, buf)
+                                    self._hdrLen = 0
+                                    return self._write(buf)
+                                buf = None
+                                file.seek(0)
+                            # Not cached, sent from the file
+                            return self._writeFileContent(file, size)
+                except :
+                    if self._hdrSent > 0 :
+                        return False
+                    self._hdrLen = 0
+                buf = None
+            return self.WriteResponseFile(filepath, contentType, headers)
+
+        # ------------------------------------------------------------------------
+
         def WriteResponseFileAttachment(self, filepath, attachmentName, headers=None) :
             if not isinstance(headers, dict) :
                 headers = { }
@@ -735,8 +1613,8 @@ class MicroWebSrv :
 
         # ------------------------------------------------------------------------
 
-        def WriteResponseNotModified(self) :
-            return self.WriteResponseError(304)
+        def WriteResponseNotModified(self, headers=None) :
+            return self.WriteResponse(304, headers, None, None, None)
 
         # ------------------------------------------------------------------------
 
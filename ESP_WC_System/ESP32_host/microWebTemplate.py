@@ -3,6 +3,8 @@ The MIT License (MIT)
 Copyright © 2018 Jean-Christophe Bos & HC² (www.hc2.fr)
 """
 
+from os   import stat
+from time import time
 import re
 
 class MicroWebTemplate :
@@ -23,10 +25,29 @@ class MicroWebTemplate :
 	INSTRUCTION_FOR			= 'for'
 	INSTRUCTION_END			= 'end'
 	INSTRUCTION_INCLUDE		= 'include'
+	INSTRUCTION_CACHE		= 'cache'
 
 	MESSAGE_TEXT            = ''
 	MESSAGE_STYLE           = ''
-	
+
+	CACHE_MAX_TEMPLATES		= 8
+	CACHE_MAX_FRAGMENTS		= 4		# Fragments kept by key value per cache instruction
+
+	# Operations of a compiled template
+	_OP_TEXT				= 0		# (_OP_TEXT, text)
+	_OP_EXPR				= 1		# (_OP_EXPR, code, line)
+	_OP_PYTHON				= 2		# (_OP_PYTHON, code, line)
+	_OP_IF					= 3		# (_OP_IF, [(condition, isName, code, ops), ...], elseOps, line)
+	_OP_FOR					= 4		# (_OP_FOR, identifier, expression, code, ops, line)
+	_OP_CACHE				= 5		# (_OP_CACHE, code, ttl, ops, {key: [expires, text, tick]}, line)
+
+    # ============================================================================
+    # ===( Class globals  )=======================================================
+    # ============================================================================
+
+	_templatesCache			= { }
+	_cacheTick				= 0
+
     # ============================================================================
     # ===( Constructor )==========================================================
     # ============================================================================
@@ -36,29 +57,71 @@ class MicroWebTemplate :
 		self._escapeStrFunc	= escapeStrFunc
 		self._filepath		= filepath
 		self._pos    		= 0
-		self._endPos 		= len(code)-1
 		self._line   		= 1
 		self._reIdentifier	= re.compile(r'[a-zA-Z_][a-zA-Z0-9_]*$')
-		self._pyGlobalVars	= { }
-		self._pyLocalVars	= { }
-		self._rendered		= ''
-		self._instructions	= {
-			MicroWebTemplate.INSTRUCTION_PYTHON : self._processInstructionPYTHON,
-			MicroWebTemplate.INSTRUCTION_IF 	: self._processInstructionIF,
-			MicroWebTemplate.INSTRUCTION_ELIF 	: self._processInstructionELIF,
-			MicroWebTemplate.INSTRUCTION_ELSE 	: self._processInstructionELSE,
-			MicroWebTemplate.INSTRUCTION_FOR 	: self._processInstructionFOR,
-			MicroWebTemplate.INSTRUCTION_END	: self._processInstructionEND,
-			MicroWebTemplate.INSTRUCTION_INCLUDE: self._processInstructionINCLUDE,
-		}
+		self._ops			= None
+		self._includes		= [ ]
 
     # ============================================================================
     # ===( Functions )============================================================
     # ============================================================================
 
+	@staticmethod
+	def FromFile(filepath, escapeStrFunc=None) :
+		# Returns the template of filepath, shared (and compiled only once)
+		# while the size and modification time of the file are unchanged.
+		st    = stat(filepath)
+		key   = (st[6], st[8], escapeStrFunc)
+		cache = MicroWebTemplate._templatesCache
+		entry = cache.get(filepath, None)
+		if entry and entry[0] == key :
+			tmpl = entry[1]
+			# Compiled again when an included file has changed
+			for incPath, incTmpl in tmpl._includes :
+				if MicroWebTemplate.FromFile(incPath, escapeStrFunc) is not incTmpl :
+					break
+			else :
+				entry[2] = MicroWebTemplate._nextCacheTick()
+				return tmpl
+		with open(filepath, 'r') as file :
+			code = file.read()
+		tmpl = MicroWebTemplate(code, escapeStrFunc=escapeStrFunc, filepath=filepath)
+		if filepath not in cache and len(cache) >= MicroWebTemplate.CACHE_MAX_TEMPLATES :
+			MicroWebTemplate._evictLRU(cache)
+		cache[filepath] = [key, tmpl, MicroWebTemplate._nextCacheTick()]
+		return tmpl
+
+	# ----------------------------------------------------------------------------
+
+	@staticmethod
+	def ClearCache() :
+		MicroWebTemplate._templatesCache.clear()
+
+	# ----------------------------------------------------------------------------
+
+	@staticmethod
+	def _nextCacheTick() :
+		MicroWebTemplate._cacheTick += 1
+		return MicroWebTemplate._cacheTick
+
+	# ----------------------------------------------------------------------------
+
+	@staticmethod
+	def _evictLRU(cache) :
+		# Removes the least recently used entry of cache, whose entries end
+		# with their tick (dict order is not the insertion one on MicroPython)
+		lru = None
+		for k in cache :
+			if lru is None or cache[k][-1] < cache[lru][-1] :
+				lru = k
+		if lru is not None :
+			del cache[lru]
+
+	# ----------------------------------------------------------------------------
+
 	def Validate(self, pyGlobalVars=None, pyLocalVars=None) :
 		try :
-			self._parseCode(pyGlobalVars, pyLocalVars, execute=False)
+			self._getOps()
 			return None
 		except Exception as ex :
 			return str(ex)
@@ -67,242 +130,215 @@ class MicroWebTemplate :
 
 	def Execute(self, pyGlobalVars=None, pyLocalVars=None) :
 		try :
-			self._parseCode(pyGlobalVars, pyLocalVars, execute=True)
-			return self._rendered
+			return ''.join(self.ExecuteIter(pyGlobalVars, pyLocalVars))
+		except Exception as ex :
+			raise Exception(str(ex))
+
+	# ----------------------------------------------------------------------------
+
+	def ExecuteIter(self, pyGlobalVars=None, pyLocalVars=None) :
+		# Returns a generator of the rendered str fragments, to send the page
+		# while it is rendered. The static text fragments are the ones of the
+		# compiled template. Template errors are raised here, before any
+		# rendering, and execution errors are raised by the generator.
+		try :
+			ops = self._getOps()
 		except Exception as ex :
 			raise Exception(str(ex))
+		gVars, lVars = self._initVars(pyGlobalVars, pyLocalVars)
+		MicroWebTemplate.MESSAGE_TEXT  = ''
+		MicroWebTemplate.MESSAGE_STYLE = ''
+		return self._renderIter(ops, gVars, lVars)
 
     # ============================================================================
     # ===( Utils  )===============================================================
     # ============================================================================
-	
-	def _parseCode(self, pyGlobalVars, pyLocalVars, execute) :
-		if pyGlobalVars:
-			self._pyGlobalVars.update(pyGlobalVars) 
-		if pyLocalVars:
-			self._pyLocalVars.update(pyLocalVars)
-		self._pyLocalVars['MESSAGE_TEXT'] = MicroWebTemplate.MESSAGE_TEXT
-		self._pyLocalVars['MESSAGE_STYLE'] = MicroWebTemplate.MESSAGE_STYLE
-		self._rendered	   = ''
-		newTokenToProcess  = self._parseBloc(execute)
-		if newTokenToProcess is not None :
-			raise Exception( '"%s" instruction is not valid here (line %s)'
-							 % (newTokenToProcess, self._line) )
-		MicroWebTemplate.MESSAGE_TEXT  = ''
-		MicroWebTemplate.MESSAGE_STYLE = ''
 
-    # ----------------------------------------------------------------------------
-
-	def _parseBloc(self, execute) :
-		while self._pos <= self._endPos :
-			c = self._code[self._pos]
-			if c == MicroWebTemplate.TOKEN_OPEN[0] and \
-			    self._code[ self._pos : self._pos + MicroWebTemplate.TOKEN_OPEN_LEN ] == MicroWebTemplate.TOKEN_OPEN :
-				self._pos    += MicroWebTemplate.TOKEN_OPEN_LEN
-				tokenContent  = ''
-				x 			  = self._pos
-				while True :
-					if x > self._endPos :
-						raise Exception("%s is missing (line %s)" % (MicroWebTemplate.TOKEN_CLOSE, self._line))
-					c = self._code[x]
-					if c == MicroWebTemplate.TOKEN_CLOSE[0] and \
-					   self._code[ x : x + MicroWebTemplate.TOKEN_CLOSE_LEN ] == MicroWebTemplate.TOKEN_CLOSE :
-					   self._pos = x + MicroWebTemplate.TOKEN_CLOSE_LEN
-					   break
-					elif c == '\n' :
-					 	self._line += 1
-					tokenContent += c
-					x 			 += 1
-				newTokenToProcess = self._processToken(tokenContent, execute)
-				if newTokenToProcess is not None :
-					return newTokenToProcess
-				continue
-			elif c == '\n' :
-				self._line += 1
-			if execute :
-				self._rendered += c
-			self._pos += 1
-		return None
+	def _getOps(self) :
+		if self._ops is None :
+			self._pos  = 0
+			self._line = 1
+			ops, token = self._compileBloc()
+			if token is not None :
+				raise Exception( '"%s" instruction is not valid here (line %s)'
+								 % (token[0], self._line) )
+			self._ops = ops
+		return self._ops
 
 	# ----------------------------------------------------------------------------
 
-	def _processToken(self, tokenContent, execute) :
-		tokenContent = tokenContent.strip()
-		parts 		 = tokenContent.split(' ', 1)
-		instructName = parts[0].strip()
-		instructBody = parts[1].strip() if len(parts) > 1 else None
-		if len(instructName) == 0 :
-			raise Exception( '"%s %s" : instruction is missing (line %s)'
-							 % (MicroWebTemplate.TOKEN_OPEN, MicroWebTemplate.TOKEN_CLOSE, self._line) )
-		newTokenToProcess = None
-		if instructName in self._instructions :
-			newTokenToProcess = self._instructions[instructName](instructBody, execute)
-		elif execute :
-			try :
-				s = str( eval( tokenContent,
-							   self._pyGlobalVars,
-							   self._pyLocalVars ) )
-				if (self._escapeStrFunc is not None) :
-					self._rendered += self._escapeStrFunc(s)
-				else :
-					self._rendered += s
-			except Exception as ex :
-				raise Exception('%s (line %s)' % (str(ex), self._line))
-		return newTokenToProcess
+	def _initVars(self, pyGlobalVars, pyLocalVars) :
+		# Each execution gets its own variables as the template can be shared
+		gVars = { }
+		lVars = { }
+		if pyGlobalVars :
+			gVars.update(pyGlobalVars)
+		if pyLocalVars :
+			lVars.update(pyLocalVars)
+		lVars['MESSAGE_TEXT']  = MicroWebTemplate.MESSAGE_TEXT
+		lVars['MESSAGE_STYLE'] = MicroWebTemplate.MESSAGE_STYLE
+		return gVars, lVars
+
+	# ----------------------------------------------------------------------------
+
+	def _nextToken(self) :
+		# Returns (text, tokenContent) from the current position, where text
+		# is the code before the next token and tokenContent is None at the end.
+		start = self._pos
+		x     = self._code.find(MicroWebTemplate.TOKEN_OPEN, start)
+		if x < 0 :
+			text       = self._code[start:]
+			self._pos  = len(self._code)
+			self._line += text.count('\n')
+			return text, None
+		text        = self._code[start:x]
+		self._line += text.count('\n')
+		x          += MicroWebTemplate.TOKEN_OPEN_LEN
+		end         = self._code.find(MicroWebTemplate.TOKEN_CLOSE, x)
+		if end < 0 :
+			self._line += self._code.count('\n', x)
+			raise Exception("%s is missing (line %s)" % (MicroWebTemplate.TOKEN_CLOSE, self._line))
+		tokenContent = self._code[x:end]
+		self._line  += tokenContent.count('\n')
+		self._pos    = end + MicroWebTemplate.TOKEN_CLOSE_LEN
+		return text, tokenContent
+
+	# ----------------------------------------------------------------------------
+
+	def _compileBloc(self) :
+		# Compiles code up to the end of the template or to an end, else or
+		# elif instruction, returned as (ops, (instructName, instructBody)).
+		ops = [ ]
+		while True :
+			text, tokenContent = self._nextToken()
+			if text :
+				ops.append((MicroWebTemplate._OP_TEXT, text))
+			if tokenContent is None :
+				return ops, None
+			tokenContent = tokenContent.strip()
+			parts 		 = tokenContent.split(' ', 1)
+			instructName = parts[0].strip()
+			instructBody = parts[1].strip() if len(parts) > 1 else None
+			if len(instructName) == 0 :
+				raise Exception( '"%s %s" : instruction is missing (line %s)'
+								 % (MicroWebTemplate.TOKEN_OPEN, MicroWebTemplate.TOKEN_CLOSE, self._line) )
+			if instructName == MicroWebTemplate.INSTRUCTION_PYTHON :
+				ops.append(self._compileInstructionPYTHON(instructBody))
+			elif instructName == MicroWebTemplate.INSTRUCTION_IF :
+				ops.append(self._compileInstructionIF(instructBody))
+			elif instructName == MicroWebTemplate.INSTRUCTION_FOR :
+				ops.append(self._compileInstructionFOR(instructBody))
+			elif instructName == MicroWebTemplate.INSTRUCTION_INCLUDE :
+				ops.extend(self._compileInstructionINCLUDE(instructBody))
+			elif instructName == MicroWebTemplate.INSTRUCTION_CACHE :
+				ops.append(self._compileInstructionCACHE(instructBody))
+			elif instructName == MicroWebTemplate.INSTRUCTION_ELIF :
+				if instructBody is None :
+					raise Exception( '"%s" alone is an incomplete syntax (line %s)'
+									 % (MicroWebTemplate.INSTRUCTION_ELIF, self._line) )
+				return ops, (instructName, instructBody)
+			elif instructName == MicroWebTemplate.INSTRUCTION_ELSE or \
+				 instructName == MicroWebTemplate.INSTRUCTION_END :
+				if instructBody is not None :
+					raise Exception( 'Instruction "%s" is invalid (line %s)'
+									 % (instructName, self._line) )
+				return ops, (instructName, None)
+			else :
+				ops.append(( MicroWebTemplate._OP_EXPR,
+							 self._compileCode(tokenContent, 'eval'),
+							 self._line ))
 
 	# ----------------------------------------------------------------------------
 
-	def _processInstructionPYTHON(self, instructionBody, execute) :
+	def _compileInstructionPYTHON(self, instructionBody) :
 		if instructionBody is not None :
 			raise Exception( 'Instruction "%s" is invalid (line %s)'
 							 % (MicroWebTemplate.INSTRUCTION_PYTHON, self._line) )
 		pyCode = ''
 		while True :
-			if self._pos > self._endPos :
+			text, tokenContent = self._nextToken()
+			pyCode += text
+			if tokenContent is None :
 				raise Exception( '"%s" instruction is missing (line %s)'
 								 % (MicroWebTemplate.INSTRUCTION_END, self._line) )
-			c = self._code[self._pos]
-			if c == MicroWebTemplate.TOKEN_OPEN[0] and \
-			   self._code[ self._pos : self._pos + MicroWebTemplate.TOKEN_OPEN_LEN ] == MicroWebTemplate.TOKEN_OPEN :
-				self._pos    += MicroWebTemplate.TOKEN_OPEN_LEN
-				tokenContent  = ''
-				x 			  = self._pos
-				while True :
-					if x > self._endPos :
-						raise Exception("%s is missing (line %s)" % (MicroWebTemplate.TOKEN_CLOSE, self._line))
-					c = self._code[x]
-					if c == MicroWebTemplate.TOKEN_CLOSE[0] and \
-					   self._code[ x : x + MicroWebTemplate.TOKEN_CLOSE_LEN ] == MicroWebTemplate.TOKEN_CLOSE :
-					   self._pos = x + MicroWebTemplate.TOKEN_CLOSE_LEN
-					   break
-					elif c == '\n' :
-					 	self._line += 1
-					tokenContent += c
-					x 			 += 1
-				tokenContent = tokenContent.strip()
-				if tokenContent == MicroWebTemplate.INSTRUCTION_END :
-					break
-				raise Exception( '"%s" is a bad instruction in a python bloc (line %s)'
-								 % (tokenContent, self._line) )				
-			elif c == '\n' :
-				self._line += 1
-			if execute :
-				pyCode += c
-			self._pos += 1
-		if execute :
-			lines  = pyCode.split('\n')
-			indent = '' 
-			for line in lines :
-				if len(line.strip()) > 0 :
-					for c in line :
-						if c == ' ' or c == '\t' :
-							indent += c
-						else :
-							break
-					break
-			pyCode = ''
-			for line in lines :
-				if line.find(indent) == 0 :
-					line = line[len(indent):]
-				pyCode += line + '\n'
-			try :
-				exec(pyCode, self._pyGlobalVars, self._pyLocalVars)
-			except Exception as ex :
-				raise Exception('%s (line %s)' % (str(ex), self._line))
-		return None
-
-	# ----------------------------------------------------------------------------
-
-	def _processInstructionIF(self, instructionBody, execute) :
-		if instructionBody is not None :
-			if execute :
-				try :
-					if (' ' not in instructionBody) and \
-					   ('=' not in instructionBody) and \
-					   ('<' not in instructionBody) and \
-					   ('>' not in instructionBody) and \
-					   (instructionBody not in self._pyGlobalVars) and \
-					   (instructionBody not in self._pyLocalVars):
-						result = False
-					else:
-						result = bool(eval(instructionBody, self._pyGlobalVars, self._pyLocalVars))
-				except Exception as ex :
-					raise Exception('%s (line %s)' % (str(ex), self._line))
-			else :
-				result = False
-			newTokenToProcess = self._parseBloc(execute and result)
-			if newTokenToProcess is not None :
-				if newTokenToProcess == MicroWebTemplate.INSTRUCTION_END :
-					return None
-				elif newTokenToProcess == MicroWebTemplate.INSTRUCTION_ELSE :
-					newTokenToProcess = self._parseBloc(execute and not result)
-					if newTokenToProcess is not None :
-						if newTokenToProcess == MicroWebTemplate.INSTRUCTION_END :
-							return None
-						raise Exception( '"%s" instruction waited (line %s)'
-										 % (MicroWebTemplate.INSTRUCTION_END, self._line) )
-					raise Exception( '"%s" instruction is missing (line %s)'
-									 % (MicroWebTemplate.INSTRUCTION_END, self._line) )
-				elif newTokenToProcess == MicroWebTemplate.INSTRUCTION_ELIF :
-					self._processInstructionIF(self._elifInstructionBody, execute and not result)
-					return None
-				raise Exception( '"%s" instruction waited (line %s)'
-								 % (MicroWebTemplate.INSTRUCTION_END, self._line) )
-			raise Exception( '"%s" instruction is missing (line %s)'
-							 % (MicroWebTemplate.INSTRUCTION_END, self._line) )
-		raise Exception( '"%s" alone is an incomplete syntax (line %s)'
-						 % (MicroWebTemplate.INSTRUCTION_IF, self._line) )
+			tokenContent = tokenContent.strip()
+			if tokenContent == MicroWebTemplate.INSTRUCTION_END :
+				break
+			raise Exception( '"%s" is a bad instruction in a python bloc (line %s)'
+							 % (tokenContent, self._line) )
+		lines  = pyCode.split('\n')
+		indent = ''
+		for line in lines :
+			if len(line.strip()) > 0 :
+				for c in line :
+					if c == ' ' or c == '\t' :
+						indent += c
+					else :
+						break
+				break
+		pyCode = [ ]
+		for line in lines :
+			if line.find(indent) == 0 :
+				line = line[len(indent):]
+			pyCode.append(line)
+		pyCode = self._compileCode('\n'.join(pyCode) + '\n', 'exec')
+		return (MicroWebTemplate._OP_PYTHON, pyCode, self._line)
 
 	# ----------------------------------------------------------------------------
 
-	def _processInstructionELIF(self, instructionBody, execute) :
+	def _compileInstructionIF(self, instructionBody) :
 		if instructionBody is None :
 			raise Exception( '"%s" alone is an incomplete syntax (line %s)'
-							 % (MicroWebTemplate.INSTRUCTION_ELIF, self._line) )
-		self._elifInstructionBody = instructionBody
-		return MicroWebTemplate.INSTRUCTION_ELIF
-
-	# ----------------------------------------------------------------------------
-
-	def _processInstructionELSE(self, instructionBody, execute) :
-		if instructionBody is not None :
-			raise Exception( 'Instruction "%s" is invalid (line %s)'
-							 % (MicroWebTemplate.INSTRUCTION_ELSE, self._line) )
-		return MicroWebTemplate.INSTRUCTION_ELSE
+							 % (MicroWebTemplate.INSTRUCTION_IF, self._line) )
+		line      = self._line
+		branches  = [ ]
+		elseOps   = None
+		condition = instructionBody
+		while True :
+			ops, token = self._compileBloc()
+			# A lone undefined name is a false condition instead of an error
+			isName = (' ' not in condition) and \
+					 ('=' not in condition) and \
+					 ('<' not in condition) and \
+					 ('>' not in condition)
+			code   = self._compileCode(condition, 'eval')
+			branches.append((condition, isName, code, ops))
+			if token is None :
+				raise Exception( '"%s" instruction is missing (line %s)'
+								 % (MicroWebTemplate.INSTRUCTION_END, self._line) )
+			if token[0] == MicroWebTemplate.INSTRUCTION_ELIF :
+				condition = token[1]
+				continue
+			if token[0] == MicroWebTemplate.INSTRUCTION_ELSE :
+				elseOps, token = self._compileBloc()
+				if token is None :
+					raise Exception( '"%s" instruction is missing (line %s)'
+									 % (MicroWebTemplate.INSTRUCTION_END, self._line) )
+				if token[0] != MicroWebTemplate.INSTRUCTION_END :
+					raise Exception( '"%s" instruction waited (line %s)'
+									 % (MicroWebTemplate.INSTRUCTION_END, self._line) )
+			return (MicroWebTemplate._OP_IF, branches, elseOps, line)
 
 	# ----------------------------------------------------------------------------
 
-	def _processInstructionFOR(self, instructionBody, execute) :
+	def _compileInstructionFOR(self, instructionBody) :
 		if instructionBody is not None :
 			parts 	   = instructionBody.split(' ', 1)
 			identifier = parts[0].strip()
 			if self._reIdentifier.match(identifier) is not None and len(parts) > 1 :
 				parts = parts[1].strip().split(' ', 1)
 				if parts[0] == 'in' and len(parts) > 1 :
-					expression  	   = parts[1].strip()
-					newTokenToProcess  = None
-					beforePos   	   = self._pos
-					if execute :
-						try :
-							result = eval(expression, self._pyGlobalVars, self._pyLocalVars)
-						except :
-							raise Exception('%s (line %s)' % (str(expression), self._line))
-					if execute and len(result) > 0 :
-						for x in result :
-							self._pyLocalVars[identifier] = x
-							self._pos  					  = beforePos
-							newTokenToProcess	  		  = self._parseBloc(True)
-							if newTokenToProcess != MicroWebTemplate.INSTRUCTION_END :
-								break
-					else :
-						newTokenToProcess = self._parseBloc(False)
-					if newTokenToProcess is not None :
-						if newTokenToProcess == MicroWebTemplate.INSTRUCTION_END :
-							return None
-						raise Exception( '"%s" instruction waited (line %s)'
+					expression = parts[1].strip()
+					line       = self._line
+					ops, token = self._compileBloc()
+					if token is None :
+						raise Exception( '"%s" instruction is missing (line %s)'
 										 % (MicroWebTemplate.INSTRUCTION_END, self._line) )
-					raise Exception( '"%s" instruction is missing (line %s)'
+					if token[0] != MicroWebTemplate.INSTRUCTION_END :
+						raise Exception( '"%s" instruction waited (line %s)'
 										 % (MicroWebTemplate.INSTRUCTION_END, self._line) )
+					code = self._compileCode(expression, 'eval')
+					return (MicroWebTemplate._OP_FOR, identifier, expression, code, ops, line)
 			raise Exception( '"%s %s" is an invalid syntax'
 							 % (MicroWebTemplate.INSTRUCTION_FOR, instructionBody) )
 		raise Exception( '"%s" alone is an incomplete syntax (line %s)'
@@ -310,26 +346,123 @@ class MicroWebTemplate :
 
 	# ----------------------------------------------------------------------------
 
-	def _processInstructionEND(self, instructionBody, execute) :
-		if instructionBody is not None :
-			raise Exception( 'Instruction "%s" is invalid (line %s)'
-							 % (MicroWebTemplate.INSTRUCTION_END, self._line) )
-		return MicroWebTemplate.INSTRUCTION_END
-
-	# ----------------------------------------------------------------------------
-
-	def _processInstructionINCLUDE(self, instructionBody, execute) :
+	def _compileInstructionINCLUDE(self, instructionBody) :
 		if not instructionBody :
 			raise Exception( '"%s" alone is an incomplete syntax (line %s)' % (MicroWebTemplate.INSTRUCTION_INCLUDE, self._line) )
 		filename = instructionBody.replace('"','').replace("'",'').strip()
-		idx = self._filepath.rindex('/')
+		idx = self._filepath.rfind('/')
 		if idx >= 0 :
 			filename = self._filepath[:idx+1] + filename
-		with open(filename, 'r') as file :
-			includeCode = file.read()
+		# The included template is compiled once in the templates cache and
+		# its operations are shared by all the templates including it.
+		includeTmpl = MicroWebTemplate.FromFile(filename, self._escapeStrFunc)
+		self._includes.append((filename, includeTmpl))
+		return includeTmpl._getOps()
+
+	# ----------------------------------------------------------------------------
+
+	def _compileInstructionCACHE(self, instructionBody) :
+		if instructionBody is None :
+			raise Exception( '"%s" alone is an incomplete syntax (line %s)'
+							 % (MicroWebTemplate.INSTRUCTION_CACHE, self._line) )
+		# {{ cache key ttl }} where key is an expression and ttl is a number
+		# of seconds, 0 to keep the fragment until the key value changes.
+		parts = instructionBody.rsplit(' ', 1)
+		try :
+			key = parts[0].strip()
+			ttl = float(parts[1])
+		except :
+			raise Exception( '"%s %s" is an invalid syntax'
+							 % (MicroWebTemplate.INSTRUCTION_CACHE, instructionBody) )
+		line       = self._line
+		ops, token = self._compileBloc()
+		if token is None :
+			raise Exception( '"%s" instruction is missing (line %s)'
+							 % (MicroWebTemplate.INSTRUCTION_END, self._line) )
+		if token[0] != MicroWebTemplate.INSTRUCTION_END :
+			raise Exception( '"%s" instruction waited (line %s)'
+							 % (MicroWebTemplate.INSTRUCTION_END, self._line) )
+		code = self._compileCode(key, 'eval')
+		return (MicroWebTemplate._OP_CACHE, code, ttl, ops, { }, line)
 
-			self._code = self._code[:self._pos] + includeCode + self._code[self._pos:]
-			self._endPos += len(includeCode)
+	# ----------------------------------------------------------------------------
+
+	def _compileCode(self, source, mode) :
+		# Compiled once here and reused on each render. When it fails (syntax
+		# error or no compile builtin), the source is kept and eval/exec on it
+		# raises the same error at render time, as before.
+		try :
+			return compile(source, self._filepath or '<pyhtml>', mode)
+		except :
+			return source
+
+	# ----------------------------------------------------------------------------
+
+	def _renderIter(self, ops, gVars, lVars) :
+		for op in ops :
+			kind = op[0]
+			if kind == MicroWebTemplate._OP_TEXT :
+				yield op[1]
+			elif kind == MicroWebTemplate._OP_EXPR :
+				try :
+					s = str(eval(op[1], gVars, lVars))
+				except Exception as ex :
+					raise Exception('%s (line %s)' % (str(ex), op[2]))
+				if self._escapeStrFunc is not None :
+					s = self._escapeStrFunc(s)
+				yield s
+			elif kind == MicroWebTemplate._OP_IF :
+				for condition, isName, code, bloc in op[1] :
+					try :
+						if isName and \
+						   (condition not in gVars) and \
+						   (condition not in lVars) :
+							result = False
+						else :
+							result = bool(eval(code, gVars, lVars))
+					except Exception as ex :
+						raise Exception('%s (line %s)' % (str(ex), op[3]))
+					if result :
+						yield from self._renderIter(bloc, gVars, lVars)
+						break
+				else :
+					if op[2] :
+						yield from self._renderIter(op[2], gVars, lVars)
+			elif kind == MicroWebTemplate._OP_FOR :
+				try :
+					result = eval(op[3], gVars, lVars)
+				except :
+					raise Exception('%s (line %s)' % (str(op[2]), op[5]))
+				for x in result :
+					lVars[op[1]] = x
+					yield from self._renderIter(op[4], gVars, lVars)
+			elif kind == MicroWebTemplate._OP_PYTHON :
+				try :
+					exec(op[1], gVars, lVars)
+				except Exception as ex :
+					raise Exception('%s (line %s)' % (str(ex), op[2]))
+			elif kind == MicroWebTemplate._OP_CACHE :
+				try :
+					key = eval(op[1], gVars, lVars)
+					# Kept as a dict key, so changing it later cannot alter the memo
+					hash(key)
+				except Exception as ex :
+					raise Exception('%s (line %s)' % (str(ex), op[5]))
+				now   = time()
+				memos = op[4]
+				memo  = memos.get(key, None)
+				if memo is not None and (memo[0] is None or now < memo[0]) :
+					memo[2] = MicroWebTemplate._nextCacheTick()
+					yield memo[1]
+				else :
+					fragments = [ ]
+					for s in self._renderIter(op[3], gVars, lVars) :
+						fragments.append(s)
+						yield s
+					if key not in memos and len(memos) >= MicroWebTemplate.CACHE_MAX_FRAGMENTS :
+						MicroWebTemplate._evictLRU(memos)
+					expires    = (now + op[2]) if op[2] > 0 else None
+					memos[key] = [expires, ''.join(fragments), MicroWebTemplate._nextCacheTick()]
 
     # ============================================================================
     # ============================================================================
@@ -1,13 +1,18 @@
 import network
 import time
 from machine import Pin
-from umqtt.simple import MQTTClient
+from wcmqtt.robust import MQTTClient  # lib/wcmqtt of ESP32_host
 import json
 
 # === Cấu hình Node ===
 NODE_ID = 'wc1'  # Unique ID: wc1, wc2, etc
 MQTT_BROKER = '192.168.100.72'  # ESP32 host IP
 MQTT_PORT = 1883
+# Statuses not acknowledged yet are kept in RAM while the broker is out of
+# reach, the oldest being dropped past MQTT_QUEUE_LEN. Set a file name to
+# also keep them on flash across a reboot (written while offline only).
+MQTT_QUEUE_LEN = 16
+MQTT_QUEUE_FILE = None  # e.g. 'mqtt_queue.bin'
 
 # === GPIO Setup ===
 led = Pin(2, Pin.OUT)  # Built-in LED (GPIO2 on ESP8266)
@@ -56,8 +61,9 @@ mqtt_client = None
 
 def mqtt_callback(topic, msg):
     try:
-        print(f"Received: {topic} - {msg}")
-        command = msg.decode()
+        # topic and msg are memoryviews of the client receive buffer
+        print(f"Received: {bytes(topic)} - {bytes(msg)}")
+        command = bytes(msg).decode()
         
         channel, action = command.split('_')
         if channel in outputs and action in ['on', 'off']:
@@ -81,19 +87,25 @@ def mqtt_callback(topic, msg):
 
 def connect_mqtt():
     global mqtt_client
-    client_id = f"{NODE_ID}_{time.ticks_ms()}"
-    mqtt_client = MQTTClient(client_id, MQTT_BROKER, port=MQTT_PORT)
+    # Stable client id, so the broker finds the session of the node again
+    client_id = f"node_{NODE_ID}"
+    # check_msg() pings the broker and reconnects it with backoff when needed
+    mqtt_client = MQTTClient(client_id, MQTT_BROKER, port=MQTT_PORT, keepalive=30,
+                             max_queue=MQTT_QUEUE_LEN, drop_oldest=True,
+                             queue_file=MQTT_QUEUE_FILE)
     mqtt_client.set_callback(mqtt_callback)
+    topic = f"wc/{NODE_ID}/command"
+    # QoS 1 in a persistent session: the broker keeps the commands published
+    # with QoS 1 while the node is offline and delivers them on reconnection
+    mqtt_client.subscribe(topic, qos=1)  # Replayed if the session was lost
     
     try:
-        mqtt_client.connect()
-        topic = f"wc/{NODE_ID}/command"
-        mqtt_client.subscribe(topic)
+        mqtt_client.connect(clean_session=False, timeout=5)
         print(f"MQTT connected, subscribed to {topic}")
         publish_status()  # Publish initial status
         return True
     except Exception as e:
-        print(f"MQTT connection failed: {e}")
+        print(f"MQTT connection failed: {e}, retrying in background")
         return False
 
 def publish_status():
@@ -104,7 +116,8 @@ def publish_status():
         
         status_json = json.dumps(status)
         topic = f"wc/{NODE_ID}/status"
-        mqtt_client.publish(topic, status_json)
+        # QoS 1: queued while offline, sent in order once reconnected
+        mqtt_client.publish(topic, status_json, qos=1)
         print(f"Published status: {status_json}")
 
 # === Utility Functions ===
@@ -123,27 +136,21 @@ def main():
         print("Cannot continue without WiFi")
         return
     
-    if not connect_mqtt():
-        print("Cannot continue without MQTT")
-        return
+    connect_mqtt()
     
     print("Node ready and listening for commands")
     
     while True:
         try:
+            # Also keeps the MQTT connection alive and reconnects it
             mqtt_client.check_msg()
             
             # Check WiFi and reconnect if needed
             if not sta_if.isconnected():
                 print("WiFi disconnected, reconnecting...")
                 connect_wifi()
-                connect_mqtt()
         except Exception as e:
             print(f"Error in main loop: {e}")
-            try:
-                mqtt_client.connect()
-            except:
-                time.sleep(5)
         
         time.sleep_ms(100)  # Small delay to prevent tight loop
 
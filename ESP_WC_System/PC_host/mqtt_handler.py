@@ -116,7 +116,8 @@ class MQTTHandler:
             # Convert to JSON and publish
             json_payload = json.dumps(payload)
             topic = f"wc/{node_id}/command"
-            result = self.client.publish(topic, json_payload)
+            # QoS 1: kept by the broker for a node offline in a persistent session
+            result = self.client.publish(topic, json_payload, qos=1)
         
             # Log command
             print(f"Published command to {topic}: {json_payload}")